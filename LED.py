@@ -1,48 +1,232 @@
-import sys
-import board
-import neopixel
+import argparse
+import logging
+import queue
+import threading
 import time
 import paho.mqtt.client as paho
 import ssl
+import metrics
+from protocol import BOARD_TOPIC, LED_CHECK, LED_COLORS, SequenceTracker, decode
 
-def main(r, g):
-    red_led_index = int(r)
-    green_led_index = int(g)
+# The NeoPixel libraries only exist on the Raspberry Pi
+try:
+    import board
+    import neopixel
+except ImportError:
+    board = None
+    neopixel = None
 
-    # Initialize the NeoPixel strip
-    pixels = neopixel.NeoPixel(board.D18, 75, brightness=1)
+LED_COUNT = 75
 
-    # Clear all LEDs
-    pixels.fill((0, 0, 0))
+    # Parameters: Index of square int
+    # Returns: Index of LED int
 
-    # Set the red LED
-    if 0 <= red_led_index < len(pixels):
-        pixels[red_led_index] = (255, 0, 0)  # Red
+def square_to_LED(index):
+    squares = {56:63,57:61,58:45,59:43,60:27,61:25,62:9,63:7,
+               48:64,49:60,50:46,51:42,52:28,53:24,54:10,55:6,
+               40:65,41:59,42:47,43:41,44:29,45:23,46:11,47:5,
+               32:66,33:58,34:48,35:40,36:30,37:22,38:12,39:4,
+               24:67,25:57,26:49,27:39,28:31,29:21,30:13,31:3,
+               16:68,17:56,18:50,19:38,20:32,21:20,22:14,23:2,
+               8:69,9:55,10:51,11:37,12:33,13:19,14:15,15:1,
+               0:70,1:54,2:52,3:36,4:34,5:18,6:16,7:0}
+    return squares[index]
+
+# Stand-in for neopixel.NeoPixel when there is no LED strip, keeps the last shown colors
+class FakePixels:
+    def __init__(self, count):
+        self.buffer = [(0, 0, 0)] * count
+        self.shown = list(self.buffer)
+        self.show_count = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, index):
+        return self.buffer[index]
+
+    def __setitem__(self, index, color):
+        self.buffer[index] = tuple(color)
+
+    def fill(self, color):
+        self.buffer = [tuple(color)] * len(self.buffer)
+
+    def show(self):
+        self.shown = list(self.buffer)
+        self.show_count += 1
+
+# Parameters: number of LEDs int, use FakePixels boolean
+# Returns: NeoPixel strip or Instance of FakePixels
+
+def create_pixels(count=LED_COUNT, fake=False):
+    if fake or neopixel is None:
+        return FakePixels(count)
+    return neopixel.NeoPixel(board.D18, count, brightness=1, auto_write=False)
+
+# Parameters: two RGB tuples, mix float 0-1
+# Returns: RGB tuple
+
+def blend(a, b, t):
+    return tuple(int(round(x + (y - x) * t)) for x, y in zip(a, b))
+
+# One thing to show on the strip: fade in to colors, hold them (pulsing the pulse LEDs),
+# then fade back to black. A hold of None keeps the colors until the next command.
+class LedCommand:
+    def __init__(self, colors, hold=7.0, fade=.3, pulse=(), pulse_period=1.0):
+        self.colors = colors
+        self.hold = hold
+        self.fade = fade
+        self.pulse = set(pulse)
+        self.pulse_period = pulse_period
+
+    # Parameters: Instance of LedCommand, seconds since the command started, colors shown when it started
+    # Returns: list of RGB tuples, True once the command has finished
+
+    def colors_at(self, elapsed, start):
+        fade = max(self.fade, 1e-6)
+        if elapsed < self.fade:
+            return [blend(a, b, elapsed / fade) for a, b in zip(start, self.colors)], False
+        elapsed -= self.fade
+        if self.hold is None or elapsed < self.hold:
+            colors = list(self.colors)
+            if self.pulse:
+                # Dim the pulsing LEDs down to a quarter and back once per period
+                phase = (elapsed % self.pulse_period) / self.pulse_period
+                level = .25 + .75 * abs(1 - 2 * phase)
+                for i in self.pulse:
+                    colors[i] = blend((0, 0, 0), colors[i], level)
+            return colors, False
+        elapsed -= self.hold
+        off = [(0, 0, 0)] * len(self.colors)
+        if elapsed < self.fade:
+            return [blend(a, b, elapsed / fade) for a, b in zip(self.colors, off)], False
+        return off, True
+
+# Owns the strip and draws on it from its own thread, so the MQTT callback only queues a
+# command and returns. A newer command replaces the one being shown, fading from
+# whatever is on the strip at that moment.
+class LedDriver:
+    def __init__(self, pixels, fps=50):
+        self.pixels = pixels
+        self.fps = fps
+        self.current = [(0, 0, 0)] * len(pixels)
+        self.commands = queue.Queue()
+        self.running = True
+        self.pixels.fill((0, 0, 0))
+        self.pixels.show()
+        self.thread = threading.Thread(target=self._render_loop, daemon=True)
+        self.thread.start()
+
+    # Parameters: Instance of LedDriver, Instance of LedCommand
+    # Returns: None
+
+    def send(self, command):
+        self.commands.put(command)
+
+    # Parameters: Instance of LedDriver, list of 64 LED palette indices (a1 = 0), hold seconds, fade seconds
+    # Returns: None
+
+    def show_frame(self, leds, hold=7.0, fade=.3):
+        colors = [(0, 0, 0)] * len(self.pixels)
+        pulse = []
+        for square, color in enumerate(leds):
+            if color:
+                colors[square_to_LED(square)] = LED_COLORS[color]
+                if color == LED_CHECK:
+                    pulse.append(square_to_LED(square))
+        self.send(LedCommand(colors, hold, fade, pulse))
+
+    # Parameters: Instance of LedDriver
+    # Returns: newest queued command, None if the driver is stopping
+    #          (waits up to timeout seconds, raises queue.Empty)
+
+    def _next_command(self, timeout):
+        command = self.commands.get(timeout=timeout)
+        while command is not None:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+        return command
+
+    # Parameters: Instance of LedDriver
+    # Returns: None
+
+    def _render_loop(self):
+        command = None
+        while self.running:
+            try:
+                # Sleep until a command arrives when idle, otherwise until the next frame
+                new = self._next_command(None if command is None else 1 / self.fps)
+                if new is None:
+                    break
+                command, started, start = new, time.monotonic(), list(self.current)
+            except queue.Empty:
+                pass
+            colors, finished = command.colors_at(time.monotonic() - started, start)
+            self._write(colors)
+            if finished:
+                command = None
+
+    # Parameters: Instance of LedDriver, list of RGB tuples
+    # Returns: None
+
+    def _write(self, colors):
+        if colors == self.current:
+            return
+        for i, color in enumerate(colors):
+            if color != self.current[i]:
+                self.pixels[i] = color
+        self.pixels.show()
+        self.current = colors
+
+    # Parameters: Instance of LedDriver
+    # Returns: None
+
+    def stop(self):
+        self.running = False
+        self.commands.put(None)
+        self.thread.join(timeout=1)
+        self.pixels.fill((0, 0, 0))
+        self.pixels.show()
 
-    # Set the green LED
-    if 0 <= green_led_index < len(pixels):
-        pixels[green_led_index] = (0, 255, 0)  # Green
-    time.sleep(7)
-    
-    pixels.fill((0,0,0))
-    pixels.show()
-    
 def on_connect(client, userdata, flags, rc, properties=None):
-    print("Connected with result code " + str(rc))
-    client.subscribe("test/topic")  # Subscribe to a test topic
+    metrics.log(logging.INFO, 'connected', rc=str(rc))
+    client.subscribe(BOARD_TOPIC)  # Subscribe to the board topic
+
+# Drops board messages that arrive after a newer one
+tracker = SequenceTracker()
+driver = None
 
 def on_message(client, userdata, message):
-    red = message.payload.decode()[:message.payload.decode().index(' ')]
-    green = message.payload.decode()[message.payload.decode().index(' ')+1:]
-    main(red, green)
+    try:
+        frame = decode(message.payload)
+    except ValueError as error:
+        metrics.log(logging.WARNING, 'ignoring message', error=str(error))
+        return
+    if tracker.accept(frame):
+        driver.show_frame(frame.leds)
+    else:
+        metrics.log(logging.INFO, 'dropping stale board', seq=frame.seq)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show board messages on the LED strip")
+    parser.add_argument('--fake', action='store_true', help="run without the LED strip")
+    parser.add_argument('--log-level', default='INFO', help="logging level")
+    args = parser.parse_args()
+    metrics.configure(level=args.log_level)
+    driver = LedDriver(create_pixels(fake=args.fake))
 
-client = paho.Client(client_id="subscriber", protocol=paho.MQTTv5)
-client.tls_set(tls_version=ssl.PROTOCOL_TLS)
-client.username_pw_set("MQTTpi", "Magicgambit10")
+    client = paho.Client(client_id="subscriber", protocol=paho.MQTTv5)
+    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
+    client.username_pw_set("MQTTpi", "Magicgambit10")
 
-client.on_connect = on_connect  # Set the on_connect callback
-client.on_message = on_message  # Set the on_message callback
+    client.on_connect = on_connect  # Set the on_connect callback
+    client.on_message = on_message  # Set the on_message callback
 
-client.connect("dc3a7b985e0541f69572b6ccc2ff6a0c.s1.eu.hivemq.cloud", 8883)
+    client.connect("dc3a7b985e0541f69572b6ccc2ff6a0c.s1.eu.hivemq.cloud", 8883)
 
-client.loop_forever()  # Start processing network traffic
+    try:
+        client.loop_forever()  # Start processing network traffic
+    finally:
+        driver.stop()
@@ -0,0 +1,258 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import argparse
+import collections
+import json
+import random
+import time
+
+import cv2
+
+import chess
+import numpy as np
+
+import vision
+from bot import ChessBot
+from dataset import labeled_frames, correct_squares
+from fusion import PIECE_CLASSES
+
+# Parameters: list of latencies in seconds
+# Returns: dict of latency mean and percentiles in milliseconds
+
+def latency_stats(latencies):
+    ms = np.array(latencies) * 1000
+    return {'mean': float(np.mean(ms)), 'p50': float(np.percentile(ms, 50)),
+            'p90': float(np.percentile(ms, 90)), 'p99': float(np.percentile(ms, 99))}
+
+# Parameters: list of latencies in seconds
+# Returns: formatted string of latency percentiles in milliseconds
+
+def latency_summary(latencies):
+    return "mean {mean:.1f}  p50 {p50:.1f}  p90 {p90:.1f}  p99 {p99:.1f} ms".format(**latency_stats(latencies))
+
+# Parameters: parsed command line arguments
+# Returns: None
+
+def bench_roi(args):
+    modes = {'full frame': None, 'board roi {}'.format(args.roi_size): args.roi_size}
+    latencies = {mode: [] for mode in modes}
+    correct = {mode: 0 for mode in modes}
+    frames = list(labeled_frames(args.frames))
+    if not frames:
+        print("No labeled frames found.")
+        return
+    # Warm up both paths so model loading and the first inference at each size are not counted
+    for roi_size in modes.values():
+        vision.read_array(frames[0][0], frames[0][2], roi_size)
+    for img, fen, calibration in frames:
+        for mode, roi_size in modes.items():
+            start = time.perf_counter()
+            array, resized = vision.read_array(img, calibration, roi_size)
+            latencies[mode].append(time.perf_counter() - start)
+            correct[mode] += correct_squares(array, fen)
+    for mode in modes:
+        print("{:<16} accuracy {:.2%}  {}".format(mode, correct[mode] / (64 * len(frames)), latency_summary(latencies[mode])))
+
+# Parameters: parsed command line arguments
+# Returns: None
+
+def bench_backends(args):
+    frames = list(labeled_frames(args.frames))
+    if not frames:
+        print("No labeled frames found.")
+        return
+    reference = None
+    for weights in args.models:
+        vision.load_model(weights)
+        # Warm up so session creation is not counted
+        vision.read_array(frames[0][0], frames[0][2], args.roi_size)
+        latencies = []
+        correct = 0
+        agree = 0
+        arrays = []
+        for img, fen, calibration in frames:
+            start = time.perf_counter()
+            array, resized = vision.read_array(img, calibration, args.roi_size)
+            latencies.append(time.perf_counter() - start)
+            correct += correct_squares(array, fen)
+            arrays.append(array)
+        if reference is None:
+            reference = arrays
+        for array, ref in zip(arrays, reference):
+            agree += sum(1 for row in range(8) for col in range(8) if array[row][col] == ref[row][col])
+        print("{:<32} accuracy {:.2%}  agreement {:.2%}  {}".format(
+            weights, correct / (64 * len(frames)), agree / (64 * len(frames)), latency_summary(latencies)))
+
+# Recognition stages in pipeline order
+RECOGNITION_STAGES = ['resize', 'inference', 'homography', 'assignment', 'fen']
+
+# Parameters: 2D array of frame, Instance of BoardCalibration, board region inference size int (whole frame if None)
+# Returns: FEN string, dict of seconds per stage
+
+def timed_recognition(img, calibration, roi_size=None):
+    times = {}
+    start = time.perf_counter()
+    if roi_size is None:
+        model_img = cv2.resize(img, (vision.IMAGE_X, vision.IMAGE_Y))
+    else:
+        model_img, crop = vision.crop_board(img, calibration, roi_size)
+    times['resize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    class_ids, points, confs = vision.detect_pieces_arrays(model_img, roi_size)
+    times['inference'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if roi_size is not None:
+        points = vision.crop_to_board(points, crop, calibration, (img.shape[1], img.shape[0]))
+    squares = calibration.squares(points)
+    times['homography'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = vision.assign_squares(calibration, class_ids, points, confs, squares)
+    times['assignment'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fen = vision.array_to_FEN([[PIECE_CLASSES[i] for i in row] for row in labels])
+    times['fen'] = time.perf_counter() - start
+    return fen, times
+
+# Parameters: parsed command line arguments
+# Returns: None
+
+def bench_recognition(args):
+    frames = list(labeled_frames(args.frames))
+    if not frames:
+        print("No labeled frames found.")
+        return
+    # Warm up so model loading is not counted
+    timed_recognition(frames[0][0], frames[0][2], args.roi_size)
+
+    stages = {stage: [] for stage in RECOGNITION_STAGES}
+    totals = []
+    correct = 0
+    boards_correct = 0
+    piece_counts = collections.Counter()
+    piece_correct = collections.Counter()
+    for repeat in range(args.repeat):
+        for img, fen, calibration in frames:
+            result, times = timed_recognition(img, calibration, args.roi_size)
+            for stage in RECOGNITION_STAGES:
+                stages[stage].append(times[stage])
+            totals.append(sum(times.values()))
+            if repeat > 0:
+                # Accuracy does not change between repeats
+                continue
+            array, truth = vision.FEN_to_array(result), vision.FEN_to_array(fen.split(' ')[0])
+            matches = correct_squares(array, fen)
+            correct += matches
+            boards_correct += matches == 64
+            for row in range(8):
+                for col in range(8):
+                    piece_counts[truth[row][col]] += 1
+                    piece_correct[truth[row][col]] += array[row][col] == truth[row][col]
+
+    results = {
+        'weights': args.weights,
+        'roi_size': args.roi_size,
+        'frames': len(frames),
+        'repeat': args.repeat,
+        'stages_ms': {stage: latency_stats(stages[stage]) for stage in RECOGNITION_STAGES},
+        'total_ms': latency_stats(totals),
+        'throughput_fps': len(totals) / sum(totals),
+        'square_accuracy': correct / (64 * len(frames)),
+        'board_accuracy': boards_correct / len(frames),
+        'piece_accuracy': {(piece or 'empty'): {'squares': piece_counts[piece], 'accuracy': piece_correct[piece] / piece_counts[piece]}
+                           for piece in PIECE_CLASSES if piece_counts[piece]},
+    }
+
+    for stage in RECOGNITION_STAGES:
+        print("{:<12} {}".format(stage, latency_summary(stages[stage])))
+    print("{:<12} {}".format('total', latency_summary(totals)))
+    print("throughput {:.1f} frames/s  square accuracy {:.2%}  board accuracy {:.2%}".format(
+        results['throughput_fps'], results['square_accuracy'], results['board_accuracy']))
+    print("  ".join("{} {:.2%}".format(piece, stats['accuracy']) for piece, stats in results['piece_accuracy'].items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+# Stands in for the position cache so every move is searched
+class NoCache:
+    def get(self, board, level):
+        return None
+
+    def put(self, board, level, move):
+        pass
+
+# Parameters: number of positions int, random seed int
+# Returns: list of Board instances from random games, early middlegame to endgame
+
+def sample_positions(count, seed=0):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = chess.Board()
+        for ply in range(rng.randint(8, 60)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        if not board.is_game_over():
+            positions.append(board)
+    return positions
+
+# Parameters: parsed command line arguments
+# Returns: None
+
+def bench_engine(args):
+    positions = sample_positions(args.positions, args.seed)
+    for level in sorted(ChessBot.level_limits):
+        bot = ChessBot(level, cache=NoCache())
+        latencies = []
+        for board in positions:
+            start = time.perf_counter()
+            bot.choose_move(board, args.clock)
+            latencies.append(time.perf_counter() - start)
+        print("level {}  {}".format(level, latency_summary(latencies)))
+    bot.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Magic Gambit benchmarks")
+    parser.add_argument('--weights', default='best.pt', help="YOLO model weights")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    roi = subparsers.add_parser('roi', help="compare full frame and board region inference")
+    roi.add_argument('frames', help="labeled frame directory")
+    roi.add_argument('--roi-size', type=int, default=320, help="board region inference size")
+    roi.set_defaults(func=bench_roi)
+
+    backends = subparsers.add_parser('backends', help="compare detector backends, the first one is the reference")
+    backends.add_argument('frames', help="labeled frame directory")
+    backends.add_argument('models', nargs='+', help=".pt weights, .onnx files or OpenVINO model directories")
+    backends.add_argument('--roi-size', type=int, default=None, help="board region inference size")
+    backends.set_defaults(func=bench_backends)
+
+    recognition = subparsers.add_parser('recognition', help="per stage latency and accuracy of board recognition")
+    recognition.add_argument('frames', help="labeled frame directory")
+    recognition.add_argument('--roi-size', type=int, default=None, help="board region inference size")
+    recognition.add_argument('--repeat', type=int, default=1, help="passes over the frames for latency")
+    recognition.add_argument('--json', help="write the results to this file")
+    recognition.set_defaults(func=bench_recognition)
+
+    engine = subparsers.add_parser('engine', help="reply latency per difficulty level on this machine")
+    engine.add_argument('--positions', type=int, default=50, help="number of sample positions")
+    engine.add_argument('--seed', type=int, default=0, help="random seed for the sample positions")
+    engine.add_argument('--clock', type=float, default=None, help="bot's remaining clock in seconds")
+    engine.set_defaults(func=bench_engine)
+
+    args = parser.parse_args()
+    if args.command in ('roi', 'recognition'):
+        vision.load_model(args.weights)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import random
+import threading
+
+import chess
+import chess.engine
+
+import metrics
+from engine_service import EngineService
+from position_cache import PositionCache
+
+STOCKFISH_PATH = r"fish\stockfish\stockfish-windows-x86-64-vnni512.exe"
+# Shared Stockfish process, started once and reused for every move
+engine_service = EngineService(STOCKFISH_PATH)
+# Moves already played from a position, shared by every board on this machine.
+# Point OPENING_BOOK_PATH at a Polyglot .bin book to also play book moves.
+POSITION_CACHE_PATH = 'positions.db'
+OPENING_BOOK_PATH = None
+position_cache = None
+
+# Parameters: None
+# Returns: shared instance of PositionCache, opened on first use
+
+def get_position_cache():
+    global position_cache
+    if position_cache is None:
+        position_cache = PositionCache(POSITION_CACHE_PATH, book_path=OPENING_BOOK_PATH)
+    return position_cache
+
+class ChessBot:
+    level_depths = {
+        2: 1,
+        3: 2,
+        4: 3,
+        5: 4
+    }
+    # Upper bounds on one search per level. The depth sets the strength, the time and node
+    # budgets keep the reply latency predictable on slow boards and in hard positions.
+    level_limits = {
+        2: {'time': .1, 'nodes': 5000},
+        3: {'time': .25, 'nodes': 20000},
+        4: {'time': .5, 'nodes': 100000},
+        5: {'time': 1, 'nodes': 400000}
+    }
+    # Moves the remaining clock is assumed to be shared between
+    clock_moves = 40
+    # Number of likely player moves to prepare a reply for while pondering
+    ponder_lines = 3
+
+    def __init__(self, level, engine=None, cache=None):
+        self.level = level
+        self.engine = engine_service if engine is None else engine
+        self.cache = get_position_cache() if cache is None else cache
+        self.ponder_board = None
+        self.ponder_replies = {}
+        self.ponder_analysis = None
+        self.ponder_stop = None
+        self.ponder_thread = None
+        self.ponder_lock = threading.Lock()
+    
+    # Parameters: Instance of ChessBot, bot's remaining clock in seconds (None for no clock)
+    # Returns: chess.engine.Limit
+
+    def search_limit(self, clock=None):
+        budget = self.level_limits[self.level]
+        search_time = budget['time']
+        if clock is not None:
+            search_time = min(search_time, max(.05, clock / self.clock_moves))
+        return chess.engine.Limit(depth=self.level_depths[self.level], time=search_time, nodes=budget['nodes'])
+
+    # Parameters: Instance of ChessBot, instance of Board class, bot's remaining clock in seconds
+    # Returns: Instance of Move.uci class
+
+    def choose_move(self, board, clock=None):
+        if self.level == 1:
+            return self.random_move(board)
+        # Every pondered reply is in before the search, this runs on the worker so waiting is fine
+        self.stop_pondering(wait=True)
+        move = self.cache.get(board, self.level)
+        if move is not None:
+            metrics.count('engine.cache_hits')
+            return move
+        move = self.pondered_reply(board)
+        if move is not None:
+            metrics.count('engine.ponder_hits')
+        else:
+            move = self.engine_move(board, self.search_limit(clock))
+        self.cache.put(board, self.level, move)
+        return move
+
+    # Parameters: Instance of ChessBot, instance of Board class with the player to move
+    # Returns: None, the analysis starts on a thread of its own
+
+    def start_pondering(self, board):
+        if self.level == 1 or board.is_game_over():
+            return
+        self.stop_pondering()
+        self.ponder_board = board.copy()
+        self.ponder_replies = {}
+        self.ponder_stop = threading.Event()
+        # Starting the analysis waits for the engine, which may still be finishing a cancelled
+        # game's search or restarting, so it is not started on the caller's (display) thread
+        self.ponder_thread = threading.Thread(target=self._ponder, daemon=True,
+                                              args=(self.ponder_board, self.ponder_replies, self.ponder_stop))
+        self.ponder_thread.start()
+
+    # Parameters: Instance of ChessBot, instance of Board class with the player to move,
+    #             dict to collect replies in, stop event of this ponder
+    # Returns: None
+
+    def _ponder(self, board, replies, stop):
+        # One ply deeper than the bot's own search, so the reply in each line has been
+        # searched as deep as a normal move at this level would be
+        depth = self.level_depths[self.level] + 1
+        try:
+            analysis = self.engine.analysis(board, chess.engine.Limit(depth=depth), self.ponder_lines)
+            with self.ponder_lock:
+                if stop.is_set():
+                    # Stopped while waiting for the engine
+                    analysis.stop()
+                else:
+                    self.ponder_analysis = analysis
+            for info in analysis:
+                pv = info.get('pv')
+                if pv and len(pv) >= 2 and info.get('depth', 0) >= depth:
+                    replies[pv[0]] = pv[1]
+        except chess.engine.EngineError:
+            pass
+
+    # Parameters: Instance of ChessBot, wait for the ponder thread to end boolean
+    # Returns: None
+
+    def stop_pondering(self, wait=False):
+        with self.ponder_lock:
+            if self.ponder_stop is not None:
+                self.ponder_stop.set()
+            if self.ponder_analysis is not None:
+                self.ponder_analysis.stop()
+                self.ponder_analysis = None
+        if wait and self.ponder_thread is not None:
+            self.ponder_thread.join()
+            self.ponder_thread = None
+
+    # Parameters: Instance of ChessBot, instance of Board class after the player's move
+    # Returns: Instance of Move.uci class prepared while pondering, or None
+
+    def pondered_reply(self, board):
+        if self.ponder_board is None or not board.move_stack:
+            return None
+        move = board.peek()
+        reply = self.ponder_replies.get(move)
+        if reply is None:
+            return None
+        expected = self.ponder_board.copy(stack=False)
+        expected.push(move)
+        if expected.fen() != board.fen() or reply not in board.legal_moves:
+            return None
+        return reply
+   
+    # Parameters: Instance of ChessBot, instance of Board class
+    # Returns: Instance of Move.uci class
+
+    def random_move(self, board):
+        return random.choice(list(board.legal_moves))
+   
+    # Parameters: Instance of ChessBot, instance of Board class, chess.engine.Limit
+    # Returns: Instance of Move.uci class
+
+    def engine_move(self, board, limit):
+        metrics.count('engine.searches')
+        with metrics.timer('engine.search'):
+            result = self.engine.play(board, limit)
+        return result.move
+   
+    # Parameters: Instance of ChessBot
+    # Returns: None
+
+    def close(self):
+        self.engine.close()
+   
+    # Parameters: FEN string, level int, color char
+    # Returns: Instance of Move.uci class
+
+def get_bot_move_from_fen(fen, level, color):
+    fen += ' ' + color
+    board = chess.Board(fen)
+    return get_bot_move(board, level)
+
+    # Parameters: Instance of Board class, level int
+    # Returns: Instance of Move.uci class
+
+def get_bot_move(board, level):
+    return ChessBot(level).choose_move(board)
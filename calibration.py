@@ -0,0 +1,173 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import logging
+
+import cv2
+import numpy as np
+
+import metrics
+
+# Parameters: 2D list of coordinate pairs, (width, height) the corners were measured in, target size
+# Returns: Nx2 float32 array of coordinate pairs
+
+def scale_corners(corners, source_size, size):
+    corners = np.array(corners, dtype=np.float32)
+    return corners * np.array([size[0]/source_size[0], size[1]/source_size[1]], dtype=np.float32)
+
+# Parameters: 4x2 array of corners in contour order, 4x2 array of approximate corners or None
+# Returns: 4x2 float32 array of corners [top left, top right, bottom left, bottom right]
+
+def order_corners(quad, hint=None):
+    quad = np.array(quad, dtype=np.float32).reshape(4, 2)
+    # Make the contour run clockwise on screen (y points down)
+    x, y = quad[:, 0], quad[:, 1]
+    if np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) < 0:
+        quad = quad[::-1]
+    candidates = []
+    for start in range(4):
+        cycle = np.roll(quad, -start, axis=0)
+        # Clockwise order is top left, top right, bottom right, bottom left
+        candidates.append(cycle[[0, 1, 3, 2]])
+        if hint is not None:
+            # The board may be mirrored relative to the hint
+            mirrored = cycle[::-1]
+            candidates.append(mirrored[[0, 1, 3, 2]])
+    if hint is None:
+        return min(candidates, key=lambda c: c[0][0] + c[0][1])
+    hint = np.array(hint, dtype=np.float32)
+    return min(candidates, key=lambda c: np.sum(np.linalg.norm(c - hint, axis=1)))
+
+# Parameters: 2D array of frame, 2D list of approximate corners in frame coordinates, minimum share of frame area
+# Returns: 4x2 float32 array of board corners in frame coordinates or None
+
+def find_board_corners(frame, hint=None, min_area=.1):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.Canny(gray, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    frame_area = frame.shape[0] * frame.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_area * frame_area:
+            break
+        approx = cv2.approxPolyDP(contour, .02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_corners(approx, hint)
+    return None
+
+# Homography between the camera image and the board plus a lookup table from every pixel
+# of the resized image to its square. Both only depend on the board corners, so they are
+# computed once, saved to disk and reloaded on the next start.
+class BoardCalibration:
+    def __init__(self, corners, size=(480, 480), source_corners=None, source_size=None, H=None, lut=None):
+        # [top left, top right, bottom left, bottom right] in the resized image
+        self.corners = np.array(corners, dtype=np.float32)
+        self.size = tuple(int(i) for i in size)
+        self.source_corners = np.array(corners if source_corners is None else source_corners, dtype=np.float32)
+        self.source_size = self.size if source_size is None else tuple(int(i) for i in source_size)
+        if H is None:
+            width, height = self.size
+            dst_pts = np.array([
+                [0, 0],
+                [width, 0],
+                [0, height],
+                [width, height]
+            ], dtype="float32")
+            H, _ = cv2.findHomography(self.corners, dst_pts)
+        self.H = H
+        self.H_inv = np.linalg.inv(H)
+        self.lut = self._build_lut() if lut is None else lut
+
+    # Parameters: 2D list of coordinate pairs, (width, height) they were measured in, target size
+    # Returns: Instance of BoardCalibration
+
+    @classmethod
+    def from_corners(cls, corners, source_size, size=(480, 480)):
+        return cls(scale_corners(corners, source_size, size), size, corners, source_size)
+
+    # Parameters: Instance of BoardCalibration
+    # Returns: 2D int8 array of square index (row * 8 + col) per pixel, -1 off the board
+
+    def _build_lut(self):
+        width, height = self.size
+        cell_width = width // 8
+        cell_height = height // 8
+        xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        pts = np.stack((xs.ravel(), ys.ravel(), np.ones(xs.size)), axis=1) @ self.H.T
+        x = np.trunc(pts[:, 0] / pts[:, 2]).astype(int)
+        y = np.trunc(pts[:, 1] / pts[:, 2]).astype(int)
+        row, col = y // cell_height, x // cell_width
+        inside = (0 <= row) & (row <= 7) & (0 <= col) & (col <= 7)
+        lut = np.where(inside, row * 8 + col, -1).astype(np.int8)
+        return lut.reshape(height, width)
+
+    # Parameters: Instance of BoardCalibration, Nx2 array of points in the resized image
+    # Returns: array of square indices, -1 for points off the board or outside the image. Points are
+    #          looked up at their nearest pixel, so a point less than half a pixel from a square edge
+    #          can land in the neighbouring square; whole pixel points match the exact projection.
+
+    def squares(self, points):
+        points = np.asarray(points)
+        if len(points) == 0:
+            return np.zeros(0, dtype=np.int8)
+        x = np.floor(points[:, 0] + .5).astype(int)
+        y = np.floor(points[:, 1] + .5).astype(int)
+        inside = (0 <= x) & (x < self.size[0]) & (0 <= y) & (y < self.size[1])
+        squares = np.full(len(points), -1, dtype=np.int8)
+        squares[inside] = self.lut[y[inside], x[inside]]
+        return squares
+
+    # Parameters: Instance of BoardCalibration, (width, height) of a camera frame
+    # Returns: 4x2 array of the calibrated corners in that frame's coordinates
+
+    def frame_corners(self, frame_size):
+        return scale_corners(self.source_corners, self.source_size, frame_size)
+
+    # Parameters: Instance of BoardCalibration, 2D array of frame, allowed error in squares, downscaled width
+    # Returns: 4x2 array of the moved corners in frame coordinates, or None if the board has not moved or
+    #          could not be found
+
+    def check_drift(self, frame, tolerance=.25, small_width=320):
+        frame_size = (frame.shape[1], frame.shape[0])
+        small_size = (small_width, int(frame.shape[0] * small_width / frame.shape[1]))
+        small = cv2.resize(frame, small_size)
+        corners = find_board_corners(small, self.frame_corners(small_size))
+        if corners is not None:
+            corners = scale_corners(corners, small_size, self.size)
+        else:
+            # Thin or low contrast board edges can vanish in the downscale, look again at full resolution
+            corners = find_board_corners(frame, self.frame_corners(frame_size))
+            if corners is None:
+                # Board edge hidden (e.g. by a hand), nothing to compare against
+                metrics.count('calibration.drift_check_failed')
+                metrics.log(logging.WARNING, 'drift check found no board corners')
+                return None
+            corners = scale_corners(corners, frame_size, self.size)
+
+        # Reproject the corners seen now through the cached grid, they should land on the grid corners
+        projected = cv2.perspectiveTransform(corners.reshape(-1, 1, 2).astype(np.float64), self.H).reshape(4, 2)
+        width, height = self.size
+        grid = np.array([[0, 0], [width, 0], [0, height], [width, height]], dtype=np.float64)
+        error = np.max(np.linalg.norm(projected - grid, axis=1)) / (width / 8)
+        if error <= tolerance:
+            return None
+        return scale_corners(corners, self.size, frame_size)
+
+    # Parameters: Instance of BoardCalibration, file path
+    # Returns: None
+
+    def save(self, path):
+        np.savez(path, corners=self.corners, size=np.array(self.size), source_corners=self.source_corners,
+                 source_size=np.array(self.source_size), H=self.H, lut=self.lut)
+
+    # Parameters: file path
+    # Returns: Instance of BoardCalibration
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['corners'], data['size'], data['source_corners'], data['source_size'], data['H'], data['lut'])
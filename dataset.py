@@ -0,0 +1,51 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import json
+import logging
+import os
+
+import cv2
+
+import metrics
+from calibration import BoardCalibration
+from vision import IMAGE_X, IMAGE_Y, FEN_to_array
+
+# A labeled frame directory holds images plus a labels.json file like:
+# [{"image": "0001.jpg", "fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR",
+#   "corners": [[130, 270], [553, 61], [448, 667], [923, 343]], "corner_size": [960, 720]}]
+# corners are [top left, top right, bottom left, bottom right] and corner_size is the
+# resolution they were measured in (the image's own resolution if left out).
+
+# Parameters: path to labeled frame directory
+# Returns: list of dicts with image path, fen and corners
+
+def load_labels(directory):
+    with open(os.path.join(directory, 'labels.json')) as f:
+        labels = json.load(f)
+    for label in labels:
+        label['image'] = os.path.join(directory, label['image'])
+    return labels
+
+# Parameters: path to labeled frame directory
+# Yields: (2D array of frame, ground truth FEN string, Instance of BoardCalibration)
+
+def labeled_frames(directory):
+    for label in load_labels(directory):
+        img = cv2.imread(label['image'])
+        if img is None:
+            metrics.log(logging.WARNING, 'failed to load frame', image=label['image'])
+            continue
+        corner_size = label.get('corner_size', (img.shape[1], img.shape[0]))
+        calibration = BoardCalibration.from_corners(label['corners'], corner_size, (IMAGE_X, IMAGE_Y))
+        yield img, label['fen'], calibration
+
+# Parameters: 2D list of position, ground truth FEN string
+# Returns: number of squares that match the ground truth
+
+def correct_squares(array, fen):
+    truth = FEN_to_array(fen.split(' ')[0])
+    return sum(1 for row in range(8) for col in range(8) if array[row][col] == truth[row][col])
@@ -0,0 +1,181 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+# Piece detector backends. Every backend takes a list of BGR frames and returns, per frame,
+# (Nx4 array of xyxy boxes, array of class ids, array of confidences) in frame pixels.
+# TorchBackend runs best.pt through ultralytics, the exported backends run an ONNX or
+# OpenVINO copy of it without PyTorch, which is much faster on the boards' CPUs.
+
+class TorchBackend:
+    def __init__(self, weights):
+        from ultralytics import YOLOv10
+        self.model = YOLOv10(weights)
+
+    # Parameters: Instance of TorchBackend, list of 2D arrays of frames, confidence float, inference size int
+    # Returns: list of (xyxy array, class id array, confidence array) per frame
+
+    def predict(self, imgs, conf=0.01, imgsz=None):
+        import supervision as sv
+        if imgsz is None:
+            results = self.model(source=list(imgs), conf=conf)
+        else:
+            results = self.model(source=list(imgs), conf=conf, imgsz=imgsz)
+        boxes = []
+        for result in results:
+            detections = sv.Detections.from_ultralytics(result)
+            boxes.append((detections.xyxy, detections.class_id, detections.confidence))
+        return boxes
+
+# Shared pre and post processing for exported YOLOv10 models. Their output is already
+# non-max suppressed: (batch, 300, 6) rows of x1, y1, x2, y2, score, class.
+class ExportedBackend:
+    def __init__(self, input_shape, half=False, imgsz=480):
+        # Dynamic axes are reported as names or -1, use imgsz for those
+        height = input_shape[2]
+        self.dynamic = not isinstance(height, int) or height <= 0
+        self.imgsz = imgsz if self.dynamic else height
+        self.half = half
+
+    # Parameters: Instance of ExportedBackend, 2D array of frame, inference size int
+    # Returns: letterboxed CHW image, (ratio, pad x, pad y)
+
+    def letterbox(self, img, size):
+        ratio = min(size / img.shape[0], size / img.shape[1])
+        width, height = round(img.shape[1] * ratio), round(img.shape[0] * ratio)
+        pad_x, pad_y = (size - width) / 2, (size - height) / 2
+        canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+        top, left = int(round(pad_y - .1)), int(round(pad_x - .1))
+        canvas[top:top + height, left:left + width] = cv2.resize(img, (width, height))
+        chw = canvas[:, :, ::-1].transpose(2, 0, 1)
+        return chw, (ratio, left, top)
+
+    # Parameters: Instance of ExportedBackend, list of 2D arrays of frames, inference size int
+    # Returns: NCHW input batch, list of letterbox parameters
+
+    def preprocess(self, imgs, imgsz=None):
+        size = self.imgsz
+        if self.dynamic and imgsz is not None:
+            size = int(np.ceil(imgsz / 32) * 32)
+        letterboxed = [self.letterbox(img, size) for img in imgs]
+        batch = np.stack([chw for chw, params in letterboxed]).astype(np.float16 if self.half else np.float32) / 255
+        return np.ascontiguousarray(batch), [params for chw, params in letterboxed]
+
+    # Parameters: Instance of ExportedBackend, (batch, N, 6) output array, list of letterbox parameters, confidence float
+    # Returns: list of (xyxy array, class id array, confidence array) per frame
+
+    def postprocess(self, output, params, conf):
+        boxes = []
+        for rows, (ratio, left, top) in zip(output.astype(np.float32), params):
+            rows = rows[rows[:, 4] >= conf]
+            xyxy = (rows[:, :4] - np.array([left, top, left, top], dtype=np.float32)) / ratio
+            boxes.append((xyxy, rows[:, 5].astype(int), rows[:, 4]))
+        return boxes
+
+    # Parameters: Instance of ExportedBackend, list of 2D arrays of frames, confidence float, inference size int
+    # Returns: list of (xyxy array, class id array, confidence array) per frame
+
+    def predict(self, imgs, conf=0.01, imgsz=None):
+        batch, params = self.preprocess(imgs, imgsz)
+        if self.batch_size is not None and self.batch_size != len(imgs):
+            # Static batch export, run the frames one at a time
+            output = np.concatenate([self.run(batch[i:i + 1]) for i in range(len(imgs))])
+        else:
+            output = self.run(batch)
+        return self.postprocess(output, params, conf)
+
+class OnnxBackend(ExportedBackend):
+    def __init__(self, path, imgsz=480, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        super().__init__(model_input.shape, model_input.type == 'tensor(float16)', imgsz)
+
+    # Parameters: Instance of OnnxBackend, NCHW input batch
+    # Returns: (batch, N, 6) output array
+
+    def run(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OpenVinoBackend(ExportedBackend):
+    def __init__(self, path, imgsz=480):
+        import openvino as ov
+        if os.path.isdir(path):
+            path = next(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.xml'))
+        core = ov.Core()
+        self.model = core.compile_model(core.read_model(path), 'CPU')
+        shape = self.model.input(0).get_partial_shape()
+        dims = [d.get_length() if d.is_static else -1 for d in shape]
+        self.batch_size = dims[0] if dims[0] > 0 else None
+        # OpenVINO converts FP16 weights back to FP32 inputs, so the input is always FP32
+        super().__init__(dims, False, imgsz)
+
+    # Parameters: Instance of OpenVinoBackend, NCHW input batch
+    # Returns: (batch, N, 6) output array
+
+    def run(self, batch):
+        return self.model(batch)[self.model.output(0)]
+
+# Parameters: path to .pt weights, .onnx file or OpenVINO model directory/.xml, inference size int
+# Returns: detector backend
+
+def load_backend(path, imgsz=480):
+    if path.endswith('.onnx'):
+        return OnnxBackend(path, imgsz)
+    if path.endswith('.xml') or path.rstrip('/\\').endswith('_openvino_model'):
+        return OpenVinoBackend(path, imgsz)
+    return TorchBackend(path)
+
+# Parameters: path to .pt weights, 'onnx' or 'openvino', inference size int, FP16 boolean, INT8 boolean,
+#             dataset yaml for INT8 calibration (OpenVINO only)
+# Returns: path of the exported model
+
+def export_model(weights='best.pt', fmt='onnx', imgsz=480, half=False, int8=False, data=None):
+    from ultralytics import YOLOv10
+    model = YOLOv10(weights)
+    if fmt == 'openvino':
+        if int8:
+            return model.export(format='openvino', imgsz=imgsz, int8=True, data=data)
+        return model.export(format='openvino', imgsz=imgsz, half=half, dynamic=True)
+
+    path = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    base = os.path.splitext(path)[0]
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized = base + '_int8.onnx'
+        quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+        return quantized
+    if half:
+        import onnx
+        from onnxconverter_common import float16
+        converted = base + '_fp16.onnx'
+        onnx.save(float16.convert_float_to_float16(onnx.load(path), keep_io_types=True), converted)
+        return converted
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the piece detector for CPU inference")
+    parser.add_argument('--weights', default='best.pt', help="YOLO model weights")
+    parser.add_argument('--format', choices=['onnx', 'openvino'], default='onnx')
+    parser.add_argument('--imgsz', type=int, default=480, help="inference size")
+    parser.add_argument('--half', action='store_true', help="FP16 weights")
+    parser.add_argument('--int8', action='store_true', help="INT8 quantization")
+    parser.add_argument('--data', help="dataset yaml for OpenVINO INT8 calibration")
+    args = parser.parse_args()
+    print(export_model(args.weights, args.format, args.imgsz, args.half, args.int8, args.data))
+
+if __name__ == '__main__':
+    main()
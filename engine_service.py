@@ -0,0 +1,92 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import atexit
+import logging
+import threading
+
+import chess.engine
+
+import metrics
+
+# One Stockfish process for the whole session. It is started once, keeps its hash table
+# between the moves of a game, is restarted if it crashes and is shut down on exit.
+class EngineService:
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options or {}
+        self.engine = None
+        self.lock = threading.RLock()
+        # Passed to the engine with every search, a new key makes it send ucinewgame
+        self.game = object()
+        atexit.register(self.close)
+
+    # Parameters: Instance of EngineService
+    # Returns: chess.engine.SimpleEngine
+
+    def start(self):
+        with self.lock:
+            if self.engine is None:
+                self.engine = chess.engine.SimpleEngine.popen_uci(self.path)
+                if self.options:
+                    self.engine.configure(self.options)
+            return self.engine
+
+    # Parameters: Instance of EngineService
+    # Returns: None
+
+    def new_game(self):
+        self.game = object()
+
+    # Parameters: Instance of EngineService, engine call taking the running engine
+    # Returns: result of the call, retried once on a fresh process if the engine died
+
+    def call(self, function):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    return function(self.start())
+                except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+                    metrics.log(logging.WARNING, 'engine failed, restarting', attempt=attempt + 1)
+                    metrics.count('engine.restarts')
+                    self._discard()
+                    if attempt == 1:
+                        raise
+
+    # Parameters: Instance of EngineService, instance of Board class, chess.engine.Limit
+    # Returns: chess.engine.PlayResult
+
+    def play(self, board, limit):
+        return self.call(lambda engine: engine.play(board, limit, game=self.game))
+
+    # Parameters: Instance of EngineService, instance of Board class, chess.engine.Limit, number of lines int
+    # Returns: chess.engine.SimpleAnalysisResult, iterate it for info and stop() it to end the search
+
+    def analysis(self, board, limit, multipv=None):
+        return self.call(lambda engine: engine.analysis(board, limit, multipv=multipv, game=self.game))
+
+    # Parameters: Instance of EngineService
+    # Returns: None
+
+    def _discard(self):
+        engine, self.engine = self.engine, None
+        if engine is not None:
+            try:
+                engine.close()
+            except Exception:
+                pass
+
+    # Parameters: Instance of EngineService
+    # Returns: None
+
+    def close(self):
+        with self.lock:
+            if self.engine is not None:
+                try:
+                    self.engine.quit()
+                except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+                    pass
+                self._discard()
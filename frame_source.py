@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import collections
+import threading
+import time
+
+import cv2
+
+import metrics
+
+# Grabs camera frames continuously on a background thread so a fresh frame is always
+# ready. The newest frames are kept in a small ring together with the monotonic time
+# they were captured, so callers can ask for a frame taken after a given moment.
+class FrameSource:
+    def __init__(self, device=0, ring_size=4):
+        self.device = device
+        self.frames = collections.deque(maxlen=ring_size)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.cap = None
+
+    # Parameters: Instance of FrameSource
+    # Returns: Instance of FrameSource
+
+    def start(self):
+        if self.running:
+            return self
+        self.cap = cv2.VideoCapture(self.device)
+        # Keep the driver queue short so grabbed frames are as new as possible
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    # Parameters: Instance of FrameSource
+    # Returns: None
+
+    def _capture_loop(self):
+        while self.running:
+            with metrics.timer('capture.read'):
+                ret, frame = self.cap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                metrics.count('capture.failed')
+                time.sleep(.01)
+                continue
+            metrics.count('capture.frames')
+            with self.condition:
+                self.frames.append((timestamp, frame))
+                self.condition.notify_all()
+
+    # Parameters: Instance of FrameSource
+    # Returns: (timestamp, frame) of the newest frame or (None, None)
+
+    def latest(self):
+        with self.condition:
+            if self.frames:
+                return self.frames[-1]
+        return None, None
+
+    # Parameters: Instance of FrameSource, monotonic time float, timeout in seconds
+    # Returns: (timestamp, frame) captured after newer_than, or (None, None) on timeout
+
+    def read(self, newer_than=None, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.frames and (newer_than is None or self.frames[-1][0] > newer_than):
+                    return self.frames[-1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return None, None
+                self.condition.wait(remaining)
+
+    # Parameters: Instance of FrameSource
+    # Returns: None
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        with self.condition:
+            self.condition.notify_all()
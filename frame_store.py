@@ -0,0 +1,341 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import atexit
+import json
+import os
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_source import FrameSource
+
+# A recording is two files next to each other:
+#   <name>.frames        header (magic, version, height, width, channels) followed by fixed
+#                        size records of a float64 capture time and the raw BGR frame, so it
+#                        can be appended to while recording and memory-mapped for replay.
+#                        FrameRecorder stores one frame a second while the scene is still
+#                        and up to 15 a second for a few seconds after something moves, a few
+#                        GB per hour of play at 640x480 instead of the ~100 GB every frame
+#                        would take. Frames can also be downscaled, but a downscaled replay
+#                        no longer matches what the detector sees live.
+#   <name>.events.jsonl  one JSON object per line with a capture time "t" and a "type",
+#                        e.g. {"t": 12.3, "type": "corners", "corners": [...], "size": [640, 480]}
+#                        or {"t": 15.1, "type": "settled", "fen": "rnbqkbnr/..."}
+MAGIC = b'MGFRAMES'
+VERSION = 1
+HEADER = struct.Struct('<8sIIII')
+
+# Raised by the game when a replay has run out of frames before the game ended
+class ReplayFinished(Exception):
+    pass
+
+# Parameters: recording path with or without extension
+# Returns: (frames path, events path)
+
+def recording_paths(path):
+    base = path[:-len('.frames')] if path.endswith('.frames') else path
+    return base + '.frames', base + '.events.jsonl'
+
+# Writes frames to a new .frames file. An existing recording is never continued: capture
+# times of another run are on another monotonic clock and would not follow this one's.
+class FrameWriter:
+    def __init__(self, path, shape):
+        self.path = path
+        self.shape = tuple(shape) if len(shape) == 3 else tuple(shape) + (1,)
+        self.file = open(path, 'xb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, *self.shape))
+        self.count = 0
+
+    # Parameters: Instance of FrameWriter, monotonic capture time float, 2D array of frame
+    # Returns: None
+
+    def append(self, timestamp, frame):
+        if frame.shape[:2] != self.shape[:2]:
+            raise ValueError("Frame size changed from {} to {}".format(self.shape[:2], frame.shape[:2]))
+        self.file.write(struct.pack('<d', timestamp))
+        self.file.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        self.count += 1
+
+    # Parameters: Instance of FrameWriter
+    # Returns: None
+
+    def close(self):
+        self.file.close()
+
+# Read-only, memory-mapped view of a .frames file. Frames are only read from disk when
+# they are used, so long recordings do not have to fit in memory.
+class FrameStore:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, height, width, channels = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(path + " is not a frame recording")
+        if version != VERSION:
+            raise ValueError("Unsupported frame recording version " + str(version))
+        self.shape = (height, width, channels)
+        self.dtype = np.dtype([('timestamp', '<f8'), ('frame', np.uint8, self.shape)])
+        self.record_size = self.dtype.itemsize
+        count = (os.path.getsize(path) - HEADER.size) // self.record_size
+        if count > 0:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    # Parameters: Instance of FrameStore, record index int
+    # Returns: (capture time float, 2D array of frame backed by the file)
+
+    def __getitem__(self, index):
+        record = self.records[index]
+        frame = record['frame']
+        if self.shape[2] == 1:
+            frame = frame[:, :, 0]
+        return float(record['timestamp']), frame
+
+    # Parameters: Instance of FrameStore
+    # Returns: array of capture times
+
+    def timestamps(self):
+        return np.asarray(self.records['timestamp'])
+
+    # Parameters: Instance of FrameStore
+    # Returns: None
+
+    def close(self):
+        mmap = getattr(self.records, '_mmap', None)
+        self.records = np.zeros(0, dtype=self.dtype)
+        if mmap is not None:
+            mmap.close()
+
+# Parameters: events path
+# Returns: list of event dicts in file order, empty if there are none
+
+def load_events(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Records what a FrameSource captures while passing it through unchanged, so the game runs
+# as usual. Frames are downscaled to width (None keeps the camera size) and written every
+# interval seconds, or every active_interval seconds for active_time seconds after motion,
+# so moves and the settled board after them are recorded densely and an idle board is not.
+# Game events (calibrated corners, settled positions) are written with record_event().
+class FrameRecorder:
+    def __init__(self, source, path, width=None, interval=1.0, active_interval=1/15, active_time=3.0,
+                 pixel_threshold=25, motion_threshold=.02):
+        self.source = source
+        self.frames_path, self.events_path = recording_paths(path)
+        for existing in (self.frames_path, self.events_path):
+            if os.path.exists(existing):
+                raise FileExistsError(existing + " already exists, record to a new name")
+        self.width = width
+        self.interval = interval
+        self.active_interval = active_interval
+        self.active_time = active_time
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        self.writer = None
+        self.events = None
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    # Parameters: Instance of FrameRecorder
+    # Returns: Instance of FrameRecorder
+
+    def start(self):
+        if self.running:
+            return self
+        self.source.start()
+        self.events = open(self.events_path, 'x')
+        self.running = True
+        self.thread = threading.Thread(target=self._record_loop, daemon=True)
+        self.thread.start()
+        # Flush the files when the game exits
+        atexit.register(self.stop)
+        return self
+
+    # Parameters: Instance of FrameRecorder
+    # Returns: None
+
+    def _record_loop(self):
+        last_frame = None
+        last_written = None
+        active_until = None
+        previous = None
+        while self.running:
+            timestamp, frame = self.source.read(last_frame, timeout=.5)
+            if frame is None:
+                continue
+            # Half a frame of slack, so every 2nd of 30 fps frames counts as 15 fps despite jitter
+            slack = 0.0 if last_frame is None else (timestamp - last_frame) / 2
+            last_frame = timestamp
+            if self.width is not None and frame.shape[1] != self.width:
+                frame = cv2.resize(frame, (self.width, int(frame.shape[0] * self.width / frame.shape[1])),
+                                   interpolation=cv2.INTER_AREA)
+            small = cv2.cvtColor(cv2.resize(frame, (80, int(frame.shape[0] * 80 / frame.shape[1]))), cv2.COLOR_BGR2GRAY)
+            if previous is not None:
+                changed = np.mean(cv2.absdiff(small, previous) > self.pixel_threshold)
+                if changed > self.motion_threshold:
+                    active_until = timestamp + self.active_time
+            previous = small
+            active = active_until is not None and timestamp <= active_until
+            interval = self.active_interval if active else self.interval
+            if last_written is not None and timestamp - last_written < interval - slack:
+                continue
+            if self.writer is None:
+                # The frame size is only known once the camera delivers
+                self.writer = FrameWriter(self.frames_path, frame.shape)
+            self.writer.append(timestamp, frame)
+            last_written = timestamp
+
+    # Parameters: Instance of FrameRecorder, event type string, event data
+    # Returns: None
+
+    def record_event(self, kind, **data):
+        event = dict(t=time.monotonic(), type=kind, **data)
+        with self.lock:
+            if self.events is not None:
+                self.events.write(json.dumps(event) + '\n')
+                self.events.flush()
+
+    # Parameters: Instance of FrameRecorder
+    # Returns: (timestamp, frame) of the newest frame or (None, None)
+
+    def latest(self):
+        return self.source.latest()
+
+    # Parameters: Instance of FrameRecorder, monotonic time float, timeout in seconds
+    # Returns: (timestamp, frame) captured after newer_than, or (None, None) on timeout
+
+    def read(self, newer_than=None, timeout=2.0):
+        return self.source.read(newer_than, timeout)
+
+    # Parameters: Instance of FrameRecorder
+    # Returns: None
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+        self.source.stop()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        with self.lock:
+            if self.events is not None:
+                self.events.close()
+                self.events = None
+
+# Plays a recording back through the FrameSource interface. Recorded capture times are
+# shifted to start at the moment replay starts. In realtime mode frames arrive with their
+# recorded spacing, like a live camera. Otherwise each frame is handed over as soon as the
+# previous one has been read, and time on the frames runs ahead of the clock.
+class ReplaySource(FrameSource):
+    def __init__(self, path, realtime=True, loop=False, ring_size=4):
+        super().__init__(None, ring_size)
+        frames_path, events_path = recording_paths(path)
+        self.store = FrameStore(frames_path)
+        self.recorded_events = load_events(events_path)
+        self.realtime = realtime
+        self.loop = loop
+        self.offset = 0.0
+        self.consumed = threading.Event()
+        self.finished = False
+
+    # Parameters: Instance of ReplaySource
+    # Returns: Instance of ReplaySource
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    # Parameters: Instance of ReplaySource
+    # Returns: None
+
+    def _capture_loop(self):
+        if len(self.store) == 0:
+            self.finished = True
+            return
+        timestamps = self.store.timestamps()
+        first = timestamps[0]
+        start = time.monotonic()
+        self.offset = start - first
+        while self.running:
+            for index in range(len(self.store)):
+                if not self.running:
+                    return
+                timestamp = start + timestamps[index] - first
+                if self.realtime:
+                    delay = timestamp - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                elif index > 0:
+                    # Wait until the consumer has taken the previous frame
+                    while self.running and not self.consumed.wait(.1):
+                        pass
+                self.consumed.clear()
+                recorded, frame = self.store[index]
+                with self.condition:
+                    self.frames.append((timestamp, frame))
+                    self.condition.notify_all()
+            if not self.loop:
+                break
+            # Continue the timeline after the last frame
+            start = start + timestamps[-1] - first + (timestamps[-1] - timestamps[-2] if len(timestamps) > 1 else 0)
+        self.finished = True
+        with self.condition:
+            self.condition.notify_all()
+
+    # Parameters: Instance of ReplaySource
+    # Returns: (timestamp, frame) of the newest frame or (None, None)
+
+    def latest(self):
+        result = super().latest()
+        if result[1] is not None:
+            self.consumed.set()
+        return result
+
+    # Parameters: Instance of ReplaySource, monotonic time float, timeout in seconds
+    # Returns: (timestamp, frame) captured after newer_than, or (None, None) on timeout or at the end
+
+    def read(self, newer_than=None, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.frames and (newer_than is None or self.frames[-1][0] > newer_than):
+                    self.consumed.set()
+                    return self.frames[-1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running or self.finished:
+                    return None, None
+                self.condition.wait(remaining)
+
+    # Parameters: Instance of ReplaySource, event type string or None for all
+    # Returns: list of recorded events with "t" shifted onto the replay timeline
+
+    def events(self, kind=None):
+        return [dict(event, t=event['t'] + self.offset) for event in self.recorded_events
+                if kind is None or event['type'] == kind]
+
+    # Parameters: Instance of ReplaySource
+    # Returns: None
+
+    def stop(self):
+        super().stop()
+        self.store.close()
@@ -0,0 +1,64 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import collections
+
+import numpy as np
+
+# Square labels in detection priority order, '' is an empty square
+PIECE_CLASSES = ['k', 'q', 'r', 'p', 'b', 'n', 'K', 'N', 'P', 'R', 'Q', 'B', '']
+CLASS_INDEX = {label: i for i, label in enumerate(PIECE_CLASSES)}
+
+# Combines the per-square readings of the last few frames into one board estimate.
+# Every frame votes for one class on each square and the fused score of a class is
+# the fraction of frames in the window that voted for it. A single frame always agrees
+# with itself, so nothing is trusted until at least min_frames frames have voted.
+class BoardFusion:
+    def __init__(self, window=5, confidence=.6, min_frames=2):
+        self.window = window
+        self.confidence = confidence
+        self.min_frames = min_frames
+        self.votes = collections.deque(maxlen=window)
+
+    # Parameters: Instance of BoardFusion, 2D list of position
+    # Returns: None
+
+    def add(self, array):
+        labels = np.array([[CLASS_INDEX[char] for char in row] for row in array])
+        self.votes.append(np.eye(len(PIECE_CLASSES), dtype=np.float32)[labels])
+
+    # Parameters: Instance of BoardFusion
+    # Returns: 8x8xN array of per-square class scores
+
+    def scores(self):
+        return np.mean(self.votes, axis=0)
+
+    # Parameters: Instance of BoardFusion
+    # Returns: 2D list of position, confidence float of the least certain square
+
+    def estimate(self):
+        if not self.votes:
+            return None, 0.0
+        scores = self.scores()
+        labels = np.argmax(scores, axis=2)
+        array = [[PIECE_CLASSES[i] for i in row] for row in labels]
+        return array, float(np.min(np.max(scores, axis=2)))
+
+    # Parameters: Instance of BoardFusion
+    # Returns: True when the estimate has both kings and enough agreement
+
+    def is_confident(self):
+        if len(self.votes) < self.min_frames:
+            return False
+        array, confidence = self.estimate()
+        flat = [char for row in array for char in row]
+        return flat.count('k') == 1 and flat.count('K') == 1 and confidence >= self.confidence
+
+    # Parameters: Instance of BoardFusion
+    # Returns: None
+
+    def clear(self):
+        self.votes.clear()
@@ -0,0 +1,266 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+
+SETUP = 'setup'
+PLAYER_TURN = 'player turn'
+RECOGNIZING = 'recognizing'
+BOT_THINKING = 'bot thinking'
+PUBLISHING = 'publishing'
+GAME_OVER = 'game over'
+
+# Chess clock for both sides on a monotonic time source. Only the side to move loses
+# time, so the remaining time is exact however late the display loop runs.
+class GameClock:
+    def __init__(self, seconds, now=time.monotonic):
+        self.now = now
+        self.remaining = {chess.WHITE: float(seconds), chess.BLACK: float(seconds)}
+        self.running = None
+        self.since = None
+
+    # Parameters: Instance of GameClock, chess.WHITE or chess.BLACK
+    # Returns: None
+
+    def start(self, side):
+        self.stop()
+        self.running = side
+        self.since = self.now()
+
+    # Parameters: Instance of GameClock
+    # Returns: None
+
+    def stop(self):
+        if self.running is not None:
+            self.remaining[self.running] -= self.now() - self.since
+        self.running = None
+        self.since = None
+
+    # Parameters: Instance of GameClock, chess.WHITE or chess.BLACK
+    # Returns: seconds left float, negative once the side has run out
+
+    def time_left(self, side):
+        if side == self.running:
+            return self.remaining[side] - (self.now() - self.since)
+        return self.remaining[side]
+
+    # Parameters: Instance of GameClock, chess.WHITE or chess.BLACK
+    # Returns: True once the side has run out of time
+
+    def flagged(self, side):
+        return self.time_left(side) <= 0
+
+    # Parameters: Instance of GameClock
+    # Returns: seconds until the running side's whole seconds change, None if stopped
+
+    def until_next_second(self):
+        if self.running is None:
+            return None
+        left = self.time_left(self.running)
+        if left <= 0:
+            return 0
+        return left % 1 or 1.0
+
+# Runs one game. Slow stages (recognizing the player's move, searching and publishing the
+# reply) run on a worker; when one finishes it queues its result and calls wake() so the
+# display loop calls process(), which makes every state change on the display thread.
+# Camera, engine and broker are passed in, so the states can be driven with fakes:
+#   recognize(board, unmoved_boards, newer_than, cancelled) -> board after the player's move or None
+#   bot.choose_move(board, seconds left), bot.start_pondering(board), bot.stop_pondering()
+#   publish(board, move, leds) -> list of deliveries with wait(timeout)
+class GameMachine:
+    def __init__(self, bot, recognize, publish, bot_color, seconds, executor=None, wake=None,
+                 now=time.monotonic, publish_timeout=2.0):
+        self.bot = bot
+        self.recognize = recognize
+        self.publish = publish
+        self.bot_side = chess.WHITE if bot_color == 'w' else chess.BLACK
+        self.clock = GameClock(seconds, now)
+        self.now = now
+        self.executor = ThreadPoolExecutor(max_workers=1) if executor is None else executor
+        self.wake = wake
+        self.publish_timeout = publish_timeout
+        self.events = queue.Queue()
+        self.state = SETUP
+        # Last known position, the player's move is recognized as one of its legal moves
+        self.board = chess.Board()
+        # Positions that mean the player has not moved yet: before and after the bot's last move,
+        # or the starting position on the player's first turn
+        self.unmoved_boards = [self.board.copy()]
+        # True if the player won, False if the bot won, None for a draw
+        self.won = None
+        self.job = 0
+        self.cancelled = threading.Event()
+
+    # Parameters: Instance of GameMachine
+    # Returns: None
+
+    def start(self):
+        if self.board.turn == self.bot_side:
+            self.clock.start(self.bot_side)
+            self._think(self.board)
+        else:
+            self._player_turn()
+
+    # Parameters: Instance of GameMachine
+    # Returns: True while it is the player's turn
+
+    def player_turn(self):
+        return self.state == PLAYER_TURN
+
+    # Parameters: Instance of GameMachine
+    # Returns: True once the game has ended
+
+    def is_over(self):
+        return self.state == GAME_OVER
+
+    # Parameters: Instance of GameMachine
+    # Returns: seconds left for the player float
+
+    def player_time(self):
+        return self.clock.time_left(not self.bot_side)
+
+    # Parameters: Instance of GameMachine
+    # Returns: seconds left for the bot float
+
+    def bot_time(self):
+        return self.clock.time_left(self.bot_side)
+
+    # Parameters: Instance of GameMachine
+    # Returns: seconds until process() has timed work to do (clock display or flag), None if nothing is scheduled
+
+    def timeout(self):
+        return self.clock.until_next_second()
+
+    # Parameters: Instance of GameMachine, monotonic time the move was finished float
+    # Returns: True if the move was accepted
+
+    def confirm_move(self, newer_than):
+        if self.state != PLAYER_TURN:
+            return False
+        self.bot.stop_pondering()
+        # Recognition and search come out of the bot's time
+        self.clock.start(self.bot_side)
+        self._submit(RECOGNIZING, self.recognize, self.board, self.unmoved_boards, newer_than, self.cancelled)
+        return True
+
+    # Parameters: Instance of GameMachine
+    # Returns: None
+
+    def cancel(self):
+        self.cancelled.set()
+        self.job += 1
+        self.clock.stop()
+        self.bot.stop_pondering()
+        self.state = GAME_OVER
+
+    # Parameters: Instance of GameMachine
+    # Returns: state string after handling everything that happened
+
+    def process(self):
+        while True:
+            try:
+                job, state, result, error = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if job != self.job or state != self.state:
+                # Finished after a restart or a flag fall
+                continue
+            if error is not None:
+                raise error
+            if state == RECOGNIZING:
+                self._recognized(result)
+            elif state == BOT_THINKING:
+                self._thought(result)
+            elif state == PUBLISHING:
+                self._published(result)
+        if self.state not in (SETUP, GAME_OVER):
+            if self.clock.flagged(not self.bot_side):
+                self._game_over(False)
+            elif self.clock.flagged(self.bot_side):
+                self._game_over(True)
+        return self.state
+
+    # Parameters: Instance of GameMachine, state string, function, its arguments
+    # Returns: None
+
+    def _submit(self, state, fn, *args):
+        self.state = state
+        self.job += 1
+        job = self.job
+
+        def run():
+            result, error = None, None
+            try:
+                result = fn(*args)
+            except Exception as e:
+                error = e
+            self.events.put((job, state, result, error))
+            if self.wake is not None:
+                self.wake()
+        self.executor.submit(run)
+
+    def _player_turn(self):
+        self.state = PLAYER_TURN
+        self.clock.start(not self.bot_side)
+        self.bot.start_pondering(self.board)
+
+    def _game_over(self, won):
+        self.cancelled.set()
+        self.clock.stop()
+        self.bot.stop_pondering()
+        self.won = won
+        self.state = GAME_OVER
+
+    # Parameters: Instance of GameMachine, position after the player's move
+    # Returns: None
+
+    def _think(self, board):
+        self.board = board
+        self._submit(BOT_THINKING, self.bot.choose_move, board, self.bot_time())
+
+    def _recognized(self, board):
+        if board is None:
+            # Only the bot's move was played on the board, keep waiting for the player
+            self._player_turn()
+            return
+        self.publish(board, board.peek() if board.move_stack else None, False)
+        if board.is_checkmate():
+            self.board = board
+            self._game_over(True)
+        elif board.is_game_over():
+            self.board = board
+            self._game_over(None)
+        else:
+            self._think(board)
+
+    def _thought(self, move):
+        board = self.board.copy()
+        board.push(move)
+        self.unmoved_boards = [self.board, board.copy()]
+        self.board = board
+        self._submit(PUBLISHING, self._publish_reply, board, move)
+
+    # Parameters: Instance of GameMachine, position after the bot's move, the bot's move
+    # Returns: None, waits until the broker has the move or publish_timeout has passed
+
+    def _publish_reply(self, board, move):
+        deadline = self.now() + self.publish_timeout
+        for delivery in self.publish(board, move, True):
+            delivery.wait(max(0, deadline - self.now()))
+
+    def _published(self, result):
+        if self.board.is_checkmate():
+            self._game_over(False)
+        elif self.board.is_game_over():
+            self._game_over(None)
+        else:
+            self._player_turn()
@@ -5,331 +5,135 @@
 # Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
 # ------------------------------------------------------------------------------------
 
-from ultralytics import YOLOv10
-import supervision as sv
-import cv2
-import numpy as np
+import argparse
+import logging
 import sys
 import pygame
 import chess
-import chess.engine
-import random
-import paho.mqtt.client as paho
-import ssl
 import time
+import os
+import math
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from frame_source import FrameSource
+from frame_store import FrameRecorder, ReplayFinished, ReplaySource, recording_paths
+from calibration import BoardCalibration, find_board_corners, scale_corners
+from vision import IMAGE_X, IMAGE_Y, load_model, read_frame_fused, read_move, warm_up_model
+from motion import MotionGate
+from bot import ChessBot, engine_service
+from mqtt_client import MqttPublisher
+from ui_cache import DirtyScreen, FrameTimer, TextCache
+from game_state import GameMachine
+from startup import Startup
+from protocol import BOARD_TOPIC, CHECK, GAME_OVER, WHITE_TO_MOVE, MessageEncoder, highlight_frame
 from pygame.locals import QUIT, MOUSEBUTTONDOWN, MOUSEBUTTONUP, MOUSEMOTION
 # -------------------------------------------------------------------------- COMPUTER VISION -----------------------------------------------------------------------------
 
-# Parameters: None
-# Returns: Initialized camera
-def initialize_camera():
-    cap = cv2.VideoCapture(0)
-    for i in range(30):
-        cap.read()
-    return cap
-
-# Parameters: Initialized camera
-# Returns: 2D array of frame
-
-def get_frame(cam):
-    ret, frame = cam.read()
-    if ret:
-        return frame
-    else:
-        print("Failed to capture image.")
-
-# Parameters: 2D array of frame, 2D list of coordinate pairs, target image size
-# Returns: 2D list of coordinate pairs
-
-def convert_corners(img, corners, size):
-    for corner in corners:
-        corner[0] *= size[0]/img.shape[1]
-        corner[1] *= size[1]/img.shape[0]
-    return corners
-
-# Parameters: 2D list of coordinate pairs
-# Returns: 2D list of coordinate pairs
-
-def initial_convert(corners):
-    for corner in corners:
-        corner[0] *= 640/960
-        corner[1] *= 480/720
-    return corners
-
-# Parameter: 2D array of frame
-# Returns: list of piece names, list of coordinate pairs
-
-def detect_pieces(img):
-  piece_dict = {
-      0: 'b',
-      1: 'k',
-      2: 'n',
-      3: 'p',
-      4: 'q',
-      5: 'r',
-      6: 'B',
-      7: 'K',
-      8: 'N',
-      9: 'P',
-      10: 'Q',
-      11: 'R'
-  }
-  results = model(source=img, conf=0.01)[0]
-  detections = sv.Detections.from_ultralytics(results)
-  coords = []
-  pieces = []
-  confs = []
-  for bbox, label, confidence in zip(detections.xyxy, detections.class_id, detections.confidence):
-      x_min, y_min, x_max, y_max = bbox
-      coords.append(((x_min+x_max)/2, (y_min + 4*y_max)/5))
-      pieces.append(piece_dict[label])
-      confs.append(confidence)
-      print(((x_min+x_max)/2, (y_min + 4*y_max)/5), piece_dict[label], confidence)
-  return pieces, coords, confs
-
-# Parameters: image path, board corners
-# Returns: 3x3 perspective transformation matrix
-
-def find_transformation_matrix(image, corners):
-
-    
-    if image is None:
-        print("Error: Image not found or unable to load.")
-        sys.exit()
-
-    height, width = image.shape[:2]
-
-    src_pts = np.array(corners, dtype="float32")
-
-    dst_pts = np.array([
-        [0, 0],
-        [width, 0],
-        [0, height],
-        [width, height]
-    ], dtype="float32")
-
-    H, _ = cv2.findHomography(src_pts, dst_pts)
-
-    return H
-
-# Parameters: image path, transformation matrix
-# Returns: None
-
-def display_grid(image, H):
-    height, width = image.shape[:2]
-    top_down_view = cv2.warpPerspective(image, H, (width, height))
-
-    cell_width = width // 8
-    cell_height = height // 8
-    for i in range(9):
-        cv2.line(top_down_view, (0, i * cell_height), (width, i * cell_height), (0, 0, 255), 2)
-        cv2.line(top_down_view, (i * cell_width, 0), (i * cell_width, height), (0, 0, 255), 2)
-
-    H_inv = np.linalg.inv(H)
-    angled_view_with_grid = cv2.warpPerspective(top_down_view, H_inv, (image.shape[1], image.shape[0]))
-
-    cv2.imshow('grid', angled_view_with_grid)
-    cv2.waitKey(0)
-
-# Parameters: 3x3 perspective transformation array, coordinate pair, image path
-# Returns: row and column of proper square (indexed from top left)
-
-def get_grid_cell(H, coords, image):
-    height, width = image.shape[:2]
-    cell_width = width // 8
-    cell_height = height // 8
-
-    pt = np.array([coords[0], coords[1], 1], dtype="float32")
-    
-    dst_pt = np.dot(H, pt)
-    dst_pt = dst_pt / dst_pt[2]
-    
-    x, y = int(dst_pt[0]), int(dst_pt[1])
-    row, col = y // cell_height, x // cell_width
-  
-    if 0 <= row and row <= 7 and 0 <= col and col <= 7:
-        return row, col
-    return -1,-1
-
-# Parameter: FEN string
-# Returns: 2D list of position
-
-def FEN_to_array(fen):
-    result = [[]]
-    for char in fen:
-        if char.isdigit():
-            for i in range(int(char)):
-                result[-1].append('')
-        elif char == '/':
-            result.append([])
-        else:
-            result[-1].append(char)
-    return result
-
-# Parameter: 2D list of position
-# Returns: FEN string
-
-def array_to_FEN(array):
-    fen = ""
-    for i in array:
-        empty_spaces = 0
-        for j in i:
-            if j == "":
-                empty_spaces += 1
-            elif empty_spaces != 0:
-                fen += str(empty_spaces)
-                fen += j
-                empty_spaces = 0
-            else:
-                fen += j
-        fen += str(empty_spaces) if empty_spaces > 0 else ''
-        fen += "/"
-    fen = fen[:len(fen)-1]
-    return fen
-
-# Parameter: 2D list of position
-# Returns: printable and formatted string of position
-
-def array_to_string(array):
-    result = ''
-    for row in array:
-        for char in row:
-            if char == '':
-                result += '-'
-            result += char
-            result += ' '
-        result += '\n'
-    return result
-
-# Parameter: 2D list of position
-# Returns: None
+# Parameters: recording path or None, replay path or None, replay in real time boolean,
+#             recorded frame width int (camera width if None)
+# Returns: Initialized camera frame source
+def initialize_camera(record=None, replay=None, realtime=True, record_width=None):
+    if replay is not None:
+        return ReplaySource(replay, realtime).start()
+    source = FrameSource(0)
+    if record is not None:
+        source = FrameRecorder(source, record, record_width)
+    return source.start()
 
-def display_board(piece_list):
-    screen = pygame.display.set_mode((480, 480))
-    pygame.display.set_caption("Chess Board")
-
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        for row in range(8):
-            for col in range(8):
-                # Determine the color of the tile
-                if (row + col) % 2 == 0:
-                    color = (227,193,111)
-                else:
-                    color = (184,139,74)
-                
-                # Draw the tile
-                pygame.draw.rect(screen, color, pygame.Rect(col * 60, row * 60, 60, 60))
-                
-                # Draw the piece, if any
-                piece = piece_list[row][col]
-                if piece != '':
-                    if piece.upper() == piece:
-                        piece_image = r'pieces\w' + piece.lower() + '.png'
-                    else:
-                        piece_image = r'pieces\b' + piece.lower() + '.png'
-                    piece_image = pygame.image.load(piece_image)
-                    piece_rect = piece_image.get_rect(center=(col * 60 + 60 // 2, row * 60 + 60 // 2))
-                    screen.blit(piece_image, piece_rect)
-        pygame.display.flip()
+# Parameters: Initialized camera frame source, event type string, event data
+# Returns: None, writes the event next to the frames when recording
 
-    pygame.quit()
+def record_event(cam, kind, **data):
+    if isinstance(cam, FrameRecorder):
+        cam.record_event(kind, **data)
 
-# Parameters: 2D array of frame, 2D list of coordinate pairs, print boolean, grid boolean, display boolean
-# Returns: FEN string
-
-def read_frame(img, corners, show_string=False, show_grid=False, show_pos=False):
-    corners = convert_corners(img, corners, (IMAGE_X,IMAGE_Y))
-    img = cv2.resize(img,(IMAGE_X,IMAGE_Y))
-    result = '8/8/8/8/8/8/8/8'
-    result = FEN_to_array(result)
-    priority = ['k','q','r','p','b','n','K','N','P','R','Q','B','']
-    types, coords, confs = detect_pieces(img)
-    M = find_transformation_matrix(img, corners)
-    for i in range(len(types)-1,-1,-1):
-        y,x = get_grid_cell(M, (coords[i][0],coords[i][1]), img)
-        if y != -1 and piece_threshold[types[i]] <= confs[i] and (priority.index(types[i]) < priority.index(result[y][x]) or (types[i] == 'b' and result[y][x] == 'k')):
-            result[y][x] = types[i]
-
-    if show_string:
-        print(array_to_string(result))
-    if show_grid:
-        display_grid(img, M)
-    if show_pos:
-        display_board(result)
-        
-    return array_to_FEN(result)
-
-# -------------------------------------------------------------------------- CHESS ENGINE -----------------------------------------------------------------------------
-class ChessBot:
-    def __init__(self, level):
-        self.level = level
-        self.engine = chess.engine.SimpleEngine.popen_uci(r"fish\stockfish\stockfish-windows-x86-64-vnni512.exe")
-    
-    # Parameters: Instance of ChessBot, instance of Board class
-    # Returns: Instance of Move.uci class
-
-    def choose_move(self, board):
-        level_depths = {
-            2: 1,
-            3: 2,
-            4: 3,
-            5: 4
-        }
-        if self.level == 1:
-            return self.random_move(board)
-        return self.engine_move(board, depth=level_depths[self.level])
-   
-    # Parameters: Instance of ChessBot, instance of Board class
-    # Returns: Instance of Move.uci class
-
-    def random_move(self, board):
-        return random.choice(list(board.legal_moves))
-   
-    # Parameters: Instance of ChessBot, instance of Board class, depth int
-    # Returns: Instance of Move.uci class
+# Parameters: Initialized camera frame source
+# Returns: True once a replay has handed out its last frame
 
-    def engine_move(self, board, depth):
-        result = self.engine.play(board, chess.engine.Limit(depth=depth))
-        return result.move
-   
-    # Parameters: Instance of ChessBot
-    # Returns: None
+def replay_finished(cam):
+    return isinstance(cam, ReplaySource) and cam.finished
 
-    def close(self):
-        self.engine.quit()
-   
-    # Parameters: FEN string, level int, color char
-    # Returns: Instance of Move.uci class
-
-def get_bot_move_from_fen(fen, level, color):
-    fen += ' ' + color
-    board = chess.Board(fen)
-    bot = ChessBot(level)
-    move = bot.choose_move(board)
-    return move
-   
-    # Parameters: Index of square int
-    # Returns: Index of LED int
+# Parameters: Initialized camera frame source, monotonic time float
+# Returns: 2D array of frame captured after newer_than
 
-def square_to_LED(index):
-    squares = {56:63,57:61,58:45,59:43,60:27,61:25,62:9,63:7,
-               48:64,49:60,50:46,51:42,52:28,53:24,54:10,55:6,
-               40:65,41:59,42:47,43:41,44:29,45:23,46:11,47:5,
-               32:66,33:58,34:48,35:40,36:30,37:22,38:12,39:4,
-               24:67,25:57,26:49,27:39,28:31,29:21,30:13,31:3,
-               16:68,17:56,18:50,19:38,20:32,21:20,22:14,23:2,
-               8:69,9:55,10:51,11:37,12:33,13:19,14:15,15:1,
-               0:70,1:54,2:52,3:36,4:34,5:18,6:16,7:0}
-    return squares[index]
+def get_frame(cam, newer_than=None):
+    timestamp, frame = cam.read(newer_than)
+    if frame is not None:
+        return frame
+    else:
+        metrics.log(logging.WARNING, 'failed to capture image')
+
+# Parameters: Initialized camera frame source, recalibrate boolean, 2D list of approximate corners,
+#             (width, height) the approximate corners were measured in
+# Returns: Instance of BoardCalibration
+
+def calibrate_board(cam, recalibrate=False, hint=None, hint_size=None):
+    if not recalibrate and os.path.exists(CALIBRATION_PATH):
+        try:
+            result = BoardCalibration.load(CALIBRATION_PATH)
+            record_event(cam, 'corners', corners=result.source_corners.tolist(), size=list(result.source_size))
+            return result
+        except (OSError, KeyError, ValueError):
+            metrics.log(logging.WARNING, 'failed to load calibration, recalibrating')
+    # Auto exposure needs a few frames to settle after the camera opens
+    warm_up = 0 if recalibrate or isinstance(cam, ReplaySource) else CAMERA_WARMUP_FRAMES
+    corners, frame_size = find_corners(cam, hint, warm_up, CALIBRATION_ATTEMPTS)
+    if corners is None and hint_size is not None:
+        # Board covered again (e.g. by a hand), the corners the hint was measured from are still
+        # far closer than the configured ones
+        metrics.log(logging.WARNING, 'failed to find board corners, using the approximate corners')
+        corners, frame_size = hint, hint_size
+    if corners is None:
+        # Not saved, so the next start tries to find the corners again
+        metrics.log(logging.WARNING, 'failed to find board corners, using configured corners')
+        result = BoardCalibration.from_corners(BOARD_CORNERS, CORNER_FRAME_SIZE, (IMAGE_X, IMAGE_Y))
+    else:
+        result = BoardCalibration.from_corners(corners, frame_size, (IMAGE_X, IMAGE_Y))
+        if not isinstance(cam, ReplaySource):
+            result.save(CALIBRATION_PATH)
+    record_event(cam, 'corners', corners=result.source_corners.tolist(), size=list(result.source_size))
+    return result
 
+# Parameters: Initialized camera frame source, 2D list of approximate corners, frames to skip int,
+#             frames to try int
+# Returns: 4x2 array of board corners or None, (width, height) of the frame they were found in
+
+def find_corners(cam, hint=None, warm_up=0, attempts=1):
+    timestamp = None
+    for i in range(warm_up):
+        timestamp, frame = cam.read(timestamp)
+        if frame is None:
+            return None, None
+    for i in range(attempts):
+        timestamp, frame = cam.read(timestamp)
+        if frame is None:
+            break
+        frame_size = (frame.shape[1], frame.shape[0])
+        if hint is None:
+            hint = scale_corners(BOARD_CORNERS, CORNER_FRAME_SIZE, frame_size)
+        corners = find_board_corners(frame, hint)
+        if corners is not None:
+            return corners, frame_size
+    return None, None
+
+# Parameters: Initialized camera frame source, Instance of BoardCalibration, monotonic time float
+# Returns: Instance of BoardCalibration, recalibrated if the board has moved
+
+def check_calibration(cam, calibration, newer_than=None):
+    if isinstance(cam, ReplaySource):
+        # The recorded board is where it was recorded, and the live calibration must not change
+        return calibration
+    timestamp, frame = cam.read(newer_than)
+    if frame is None:
+        return calibration
+    corners = calibration.check_drift(frame)
+    if corners is None:
+        return calibration
+    metrics.log(logging.INFO, 'board moved, recalibrating')
+    metrics.count('calibration.drift')
+    return calibrate_board(cam, True, corners, (frame.shape[1], frame.shape[0]))
 
 # -------------------------------------------------------------------------- LCD DISPLAY -----------------------------------------------------------------------------
-pygame.init()
 
 time_map = {
     '5 min': 5 * 60,
@@ -363,22 +167,26 @@ positions = [
     for i in range(num_positions)
 ]
 
-# Font settings
-num_font = pygame.font.SysFont(None, int(80 * scaling_factor))
-text_font = pygame.font.SysFont(None, int(120 * scaling_factor))
-title_font = pygame.font.SysFont(None, int(200 * scaling_factor))
+# Font sizes, fonts and rendered text are cached in text_cache
+NUM_FONT_SIZE = int(80 * scaling_factor)
+TEXT_FONT_SIZE = int(120 * scaling_factor)
+TITLE_FONT_SIZE = int(200 * scaling_factor)
+CLOCK_FONT_SIZE = int(150 * scaling_factor)
+END_FONT_SIZE = int(250 * scaling_factor)
+text_cache = TextCache()
+# Redraws only the parts of the screen that changed, created with the display
+ui = None
+# Time spent drawing each frame of the game loop
+frame_timer = FrameTimer()
 
 # Button settings
 button_color = (0, 200, 0)
 button_hover_color = (0, 255, 0)
 button_rect = pygame.Rect(824 * scaling_factor, 400 * scaling_factor, 400 * scaling_factor, 160 * scaling_factor)
-button_text = text_font.render("START", True, (0, 0, 0))
 
 # Toggle button settings
 toggle_button_color = (200, 200, 200)
 toggle_button_rect = pygame.Rect(324 * scaling_factor, 400 * scaling_factor, 400 * scaling_factor, 160 * scaling_factor)
-toggle_text_black = text_font.render("BLACK", True, (200, 200, 200))
-toggle_text_white = text_font.render("WHITE", True, (0, 0, 0))
 is_black = False
 
 # Time control button settings
@@ -390,83 +198,110 @@ time_button_rect = pygame.Rect(1324 * scaling_factor, 400 * scaling_factor, 400
 restart_button_color = (200, 0, 0)
 restart_button_hover_color = (255, 0, 0)
 restart_button_rect = pygame.Rect(1598 * scaling_factor, 50 * scaling_factor, 400 * scaling_factor, 160 * scaling_factor)
-restart_button_text = text_font.render("RESTART", True, (200, 200, 200))
 
 # Move confirmation button settings
 confirm_button_color = (200, 200, 200)
 confirm_button_hover_color = (255, 255, 255)
 confirm_button_rect = pygame.Rect(624 * scaling_factor, 1000 * scaling_factor, 800 * scaling_factor, 160 * scaling_factor)
-confirm_button_text = text_font.render("CONFIRM MOVE", True, (30, 30, 30))
-   
-# Parameters: Instance of pygame screen class
+
+# Parameters: Instance of pygame screen class, screen name string
+# Returns: Instance of DirtyScreen
+
+def ui_layer(screen, mode):
+    global ui
+    if ui is None or ui.screen is not screen:
+        ui = DirtyScreen(screen)
+    ui.set_mode(mode)
+    return ui
+
+# Parameters: Instance of DirtyScreen, region name, pygame Rect, fill color, text string, font size int, text color
+# Returns: None
+
+def draw_button(layer, name, rect, color, text, size, text_color):
+    text_surface = text_cache.render(text, size, text_color)
+
+    def paint(screen):
+        pygame.draw.rect(screen, color, rect)
+        screen.blit(text_surface, (rect.x + (rect.width - text_surface.get_width()) // 2,
+                                   rect.y + (rect.height - text_surface.get_height()) // 2))
+    layer.draw(name, (color, text), rect, paint)
+
+# Parameters: Instance of DirtyScreen, region name, text string, font size int, (x, y) center
 # Returns: None
 
-def draw_slider(screen):
-    pygame.draw.rect(screen, slider_color, slider_rect)
-    pygame.draw.rect(screen, knob_color, knob_rect)
-    title_text = title_font.render("MAGIC GAMBIT", True, (200, 200, 200))
-    difficulty_text = text_font.render("DIFFICULTY", True, (200, 200, 200))
-    screen.blit(difficulty_text, (800 * scaling_factor, 950 * scaling_factor))
-    screen.blit(title_text, (512 * scaling_factor, 50 * scaling_factor))
+def draw_centered_text(layer, name, text, size, center):
+    text_surface = text_cache.render(text, size, (200, 200, 200))
+    rect = text_surface.get_rect(center=center)
+    layer.draw(name, text, rect, lambda screen: screen.blit(text_surface, rect))
 
-    # Draw snap position lines and numbers
+# Parameters: Instance of DirtyScreen
+# Returns: None
+
+def draw_slider(layer):
+    title_text = text_cache.render("MAGIC GAMBIT", TITLE_FONT_SIZE, (200, 200, 200))
+    difficulty_text = text_cache.render("DIFFICULTY", TEXT_FONT_SIZE, (200, 200, 200))
+    layer.draw('title', None, title_text.get_rect(topleft=(512 * scaling_factor, 50 * scaling_factor)),
+               lambda screen: screen.blit(title_text, (512 * scaling_factor, 50 * scaling_factor)))
+    layer.draw('difficulty', None, difficulty_text.get_rect(topleft=(800 * scaling_factor, 950 * scaling_factor)),
+               lambda screen: screen.blit(difficulty_text, (800 * scaling_factor, 950 * scaling_factor)))
+
+    # The knob reaches above and below the bar
+    def paint_slider(screen):
+        pygame.draw.rect(screen, slider_color, slider_rect)
+        pygame.draw.rect(screen, knob_color, knob_rect)
+    layer.draw('slider', knob_rect.x, slider_rect.union(pygame.Rect(slider_rect.x, knob_rect.y, 1, knob_rect.height)), paint_slider)
+
+    # Draw snap position numbers
     for i, pos in enumerate(positions):
-        num_text = num_font.render(str(i + 1), True, (200, 200, 200))
-        screen.blit(num_text, (pos + knob_rect.width // 2 - num_text.get_width() // 2, slider_rect.y + slider_rect.height + 60 * scaling_factor))
-   
-# Parameters: Instance of pygame screen class
+        num_text = text_cache.render(str(i + 1), NUM_FONT_SIZE, (200, 200, 200))
+        num_pos = (pos + knob_rect.width // 2 - num_text.get_width() // 2, slider_rect.y + slider_rect.height + 60 * scaling_factor)
+        layer.draw('number ' + str(i), None, num_text.get_rect(topleft=num_pos),
+                   lambda screen, num_text=num_text, num_pos=num_pos: screen.blit(num_text, num_pos))
+
+# Parameters: Instance of DirtyScreen
 # Returns: None
 
-def draw_confirm_button(screen):
+def draw_confirm_button(layer):
     mouse_pos = pygame.mouse.get_pos()
     if confirm_button_rect.collidepoint(mouse_pos):
         color = confirm_button_hover_color
     else:
         color = confirm_button_color
-    pygame.draw.rect(screen, color, confirm_button_rect)
-    screen.blit(confirm_button_text, (confirm_button_rect.x + (confirm_button_rect.width - confirm_button_text.get_width()) // 2,
-                              confirm_button_rect.y + (confirm_button_rect.height - confirm_button_text.get_height()) // 2))
+    draw_button(layer, 'confirm', confirm_button_rect, color, "CONFIRM MOVE", TEXT_FONT_SIZE, (30, 30, 30))
 
-def draw_start_button(screen):
+def draw_start_button(layer):
     mouse_pos = pygame.mouse.get_pos()
     if button_rect.collidepoint(mouse_pos):
         color = button_hover_color
     else:
         color = button_color
-    pygame.draw.rect(screen, color, button_rect)
-    screen.blit(button_text, (button_rect.x + (button_rect.width - button_text.get_width()) // 2,
-                              button_rect.y + (button_rect.height - button_text.get_height()) // 2))
-   
-# Parameters: Instance of pygame screen class
+    draw_button(layer, 'start', button_rect, color, "START", TEXT_FONT_SIZE, (0, 0, 0))
+
+# Parameters: Instance of DirtyScreen
 # Returns: None
 
-def draw_restart_button(screen):
+def draw_restart_button(layer):
     mouse_pos = pygame.mouse.get_pos()
     if restart_button_rect.collidepoint(mouse_pos):
         color = restart_button_hover_color
     else:
         color = restart_button_color
-    pygame.draw.rect(screen, color, restart_button_rect)
-    screen.blit(restart_button_text, (restart_button_rect.x + (restart_button_rect.width - restart_button_text.get_width()) // 2,
-                              restart_button_rect.y + (restart_button_rect.height - restart_button_text.get_height()) // 2))
-     
-# Parameters: Instance of pygame screen class
+    draw_button(layer, 'restart', restart_button_rect, color, "RESTART", TEXT_FONT_SIZE, (200, 200, 200))
+
+# Parameters: Instance of DirtyScreen
 # Returns: None
-  
-def draw_toggle_button(screen):
-    pygame.draw.rect(screen, (0, 0, 0) if is_black else toggle_button_color, toggle_button_rect)
-    text = toggle_text_black if is_black else toggle_text_white
-    screen.blit(text, (toggle_button_rect.x + (toggle_button_rect.width - text.get_width()) // 2,
-                       toggle_button_rect.y + (toggle_button_rect.height - text.get_height()) // 2))
-   
-# Parameters: Instance of pygame screen class
+
+def draw_toggle_button(layer):
+    if is_black:
+        draw_button(layer, 'toggle', toggle_button_rect, (0, 0, 0), "BLACK", TEXT_FONT_SIZE, (200, 200, 200))
+    else:
+        draw_button(layer, 'toggle', toggle_button_rect, toggle_button_color, "WHITE", TEXT_FONT_SIZE, (0, 0, 0))
+
+# Parameters: Instance of DirtyScreen
 # Returns: None
 
-def draw_time_button(screen):
-    time_text = text_font.render(time_controls[time_index], True, (0, 0, 0))
-    pygame.draw.rect(screen, (200, 200, 200), time_button_rect)
-    screen.blit(time_text, (time_button_rect.x + (time_button_rect.width - time_text.get_width()) // 2,
-                            time_button_rect.y + (time_button_rect.height - time_text.get_height()) // 2))
+def draw_time_button(layer):
+    draw_button(layer, 'time', time_button_rect, (200, 200, 200), time_controls[time_index], TEXT_FONT_SIZE, (0, 0, 0))
    
 # Parameters: int coordinate of knob x position
 # Returns: int coordinate of nearest snapping point
@@ -500,19 +335,23 @@ def display_setup(screen):
                 knob_rect.x = event.pos[0] - knob_rect.width // 2
                 knob_rect.x = max(slider_rect.x, min(knob_rect.x, slider_rect.right - knob_rect.width))
 
-    screen.fill((30, 30, 30))  # Clear screen with a background color
-    draw_slider(screen)
-    draw_start_button(screen)
-    draw_toggle_button(screen)
-    draw_time_button(screen)
-    pygame.display.update()
+    layer = ui_layer(screen, 'setup')
+    draw_slider(layer)
+    draw_start_button(layer)
+    draw_toggle_button(layer)
+    draw_time_button(layer)
+    layer.flip()
    
 # Parameters: Instance of pygame screen class
 # Returns: None
 
 def get_settings(screen):
+    clock = pygame.time.Clock()
     settings = display_setup(screen)
+    if startup is not None:
+        startup.mark('settings screen')
     while settings is None:
+        clock.tick(30)
         settings = display_setup(screen)
     difficulty, color, time = settings
     if color:
@@ -521,199 +360,352 @@ def get_settings(screen):
         color = 'b'
     return difficulty, color, time
   
-# Parameters: Instance of pygame screen class, time left int
-# Returns: None or restart string
+# Parameters: timeout in seconds or None to wait for the next event
+# Returns: list of pygame events, empty if the timeout passed first
 
-def display_timer(screen, total_time):
-    global is_bot_turn
-    font = pygame.font.SysFont(None, int(150 * scaling_factor))
+def wait_for_events(timeout=None):
+    if timeout is None:
+        event = pygame.event.wait()
+    else:
+        event = pygame.event.wait(max(1, int(timeout * 1000)))
+    return [e for e in [event] + pygame.event.get() if e.type != pygame.NOEVENT]
+
+# Parameters: Instance of pygame screen class, time left int, player's turn boolean, list of pygame events
+# Returns: None, restart string or confirm string
 
+def display_timer(screen, total_time, player_turn, events):
     minutes = total_time // 60
     seconds = total_time % 60
     time_display = f"{minutes:02}:{seconds:02}"
 
-    screen.fill((30, 30, 30))
-    time_text = font.render(time_display, True, (200, 200, 200))
-    move_text = font.render("YOUR MOVE", True, (200, 200, 200)) if not is_bot_turn else font.render("BOT'S MOVE", True, (200, 200, 200))
-    screen.blit(time_text, (screen.get_width() // 2 - time_text.get_width() // 2,
-                            screen.get_height() // 2 - time_text.get_height() // 2))
-    screen.blit(move_text, (screen.get_width() // 2 - move_text.get_width() // 2,
-                            screen.get_height() // 2 - move_text.get_height() // 2 + 200 * scaling_factor))
+    # Only the regions whose text or hover state changed are redrawn, usually just the clock once a second
+    layer = ui_layer(screen, 'timer')
+    center_x, center_y = screen.get_width() // 2, screen.get_height() // 2
+    draw_centered_text(layer, 'clock', time_display, CLOCK_FONT_SIZE, (center_x, center_y))
+    draw_centered_text(layer, 'turn', "YOUR MOVE" if player_turn else "BOT'S MOVE", CLOCK_FONT_SIZE,
+                       (center_x, center_y + 200 * scaling_factor))
 
-    draw_restart_button(screen)
-    if not is_bot_turn:
-        draw_confirm_button(screen)
+    draw_restart_button(layer)
+    if player_turn:
+        draw_confirm_button(layer)
+    else:
+        layer.remove('confirm')
 
-    pygame.display.update()
+    layer.flip()
 
-    for event in pygame.event.get():
+    for event in events:
         if event.type == pygame.QUIT:
             pygame.quit()
             sys.exit()
         elif event.type == pygame.MOUSEBUTTONDOWN:
             if restart_button_rect.collidepoint(event.pos):
                 return 'restart'
-            elif confirm_button_rect.collidepoint(event.pos) and not is_bot_turn:
-                is_bot_turn = True
+            elif confirm_button_rect.collidepoint(event.pos) and player_turn:
+                return 'confirm'
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_SPACE:
-                is_bot_turn = True
+                return 'confirm'
             elif event.key == pygame.K_q:
                 pygame.quit()
                 sys.exit()
 
   
-# Parameters: Instance of pygame screen class, win boolean
+# Parameters: Instance of pygame screen class, win boolean or None for a draw, list of pygame events
 # Returns: None or restart string
 
-def display_end(screen, win):
-    screen.fill((30,30,30))
-    font = pygame.font.SysFont(None, int(250 * scaling_factor))
-    if win:
-        win_text = font.render("YOU WIN!", True, (200, 200, 200))
+def display_end(screen, win, events):
+    layer = ui_layer(screen, 'end')
+    if win is None:
+        result = "DRAW"
     else:
-        win_text = font.render("YOU LOSE!", True, (200, 200, 200))
-    screen.blit(win_text, (screen.get_width() // 2 - win_text.get_width() // 2,
-                            screen.get_height() // 2 - win_text.get_height() // 2))
-    draw_restart_button(screen)
-    for event in pygame.event.get():
+        result = "YOU WIN!" if win else "YOU LOSE!"
+    draw_centered_text(layer, 'result', result, END_FONT_SIZE, (screen.get_width() // 2, screen.get_height() // 2))
+    draw_restart_button(layer)
+    layer.flip()
+    for event in events:
         if event.type == pygame.QUIT:
             pygame.quit()
             sys.exit()
         elif event.type == pygame.MOUSEBUTTONDOWN:
             if restart_button_rect.collidepoint(event.pos):
                 return 'restart'
-    pygame.display.update()
 # -------------------------------------------------------------------------- MQTT -----------------------------------------------------------------------------
   
-# Parameters: red LED int, green LED int
+# Long-lived connections to the LED and board display brokers, opened by connect_brokers()
+led_publisher = None
+fen_publisher = None
+
+# Parameters: None
+# Returns: None
+
+def connect_brokers():
+    global led_publisher, fen_publisher
+    led_publisher = MqttPublisher("dc3a7b985e0541f69572b6ccc2ff6a0c.s1.eu.hivemq.cloud", "MQTTpi", "Magicgambit10")
+    fen_publisher = MqttPublisher("c424fde2a0ed48538e2b798a0d0e4c38.s1.eu.hivemq.cloud", "fensetup", "Magicgambit10")
+
+# Numbers the board messages so subscribers can drop stale ones
+board_encoder = MessageEncoder()
+
+# Parameters: Instance of chess.Board, last move or None, send to the LED board boolean
+# Returns: list of Delivery
+
+def publish_board(board, move=None, leds=True):
+    check_square = board.king(board.turn) if board.is_check() else None
+    if move is None:
+        frame = highlight_frame(check_square=check_square)
+    else:
+        frame = highlight_frame(move.from_square, move.to_square, check_square)
+    flags = WHITE_TO_MOVE if board.turn == chess.WHITE else 0
+    if board.is_check():
+        flags |= CHECK
+    if board.is_game_over():
+        flags |= GAME_OVER
+    # One message carries the position and the LED frame to both subscribers
+    payload = board_encoder.encode(board.board_fen(), frame, flags)
+    deliveries = [fen_publisher.publish(BOARD_TOPIC, payload)]
+    if leds:
+        deliveries.append(led_publisher.publish(BOARD_TOPIC, payload))
+    return deliveries
+# -------------------------------------------------------------------------- MAIN -----------------------------------------------------------------------------
+# Number of frames combined into one board estimate and the share of them that must agree
+FUSION_WINDOW = 5
+FUSION_CONFIDENCE = .6
+# Share of the likelihood the best legal move needs before it is accepted without
+# falling back to reading the whole board
+MOVE_CONFIDENCE = .9
+# Approximate board corners in camera coordinates, measured on a 960x720 image. They are
+# only used to orient automatically found corners and as a fallback if none are found.
+# [top left, top right, bottom left, bottom right]
+BOARD_CORNERS = [[130, 270], [553, 61], [448, 667], [923, 343]]
+CORNER_FRAME_SIZE = (960, 720)
+CALIBRATION_PATH = 'calibration.npz'
+# Frames skipped after the camera opens before looking for the board, then frames tried
+CAMERA_WARMUP_FRAMES = 30
+CALIBRATION_ATTEMPTS = 10
+# Recognized player moves between checks that the board has not shifted since calibration
+DRIFT_CHECK_INTERVAL = 5
+# Inference size for board region inference, None runs YOLO on the whole frame.
+# Compare both with "python benchmark.py roi <frames>" before enabling on a board.
+ROI_SIZE = None
+# Piece detector: best.pt runs on PyTorch, an exported .onnx file or _openvino_model
+# directory (see detector.py) runs on a lighter CPU runtime
+DETECTOR_WEIGHTS = 'best.pt'
+# End the player's turn automatically once a move has been made and the board is still
+# for MOVE_SETTLE_TIME seconds. CONFIRM MOVE and space keep working either way.
+AUTO_MOVE_DETECTION = True
+MOVE_SETTLE_TIME = 1.0
+# Set up by start_app() and wait_for_startup()
+camera = None
+calibration = None
+window = None
+startup = None
+
+# Parameters: recording path or None, replay path or None, replay in real time boolean,
+#             recorded frame width int (camera width if None)
+# Returns: Initialized camera frame source, Instance of BoardCalibration
+
+def start_camera(record=None, replay=None, realtime=True, record_width=None):
+    cam = initialize_camera(record, replay, realtime, record_width)
+    if replay is not None:
+        corners = cam.events('corners')
+        if corners:
+            # Use the board as it was calibrated while recording
+            return cam, BoardCalibration.from_corners(corners[0]['corners'], corners[0]['size'], (IMAGE_X, IMAGE_Y))
+    return cam, calibrate_board(cam)
+
+# Parameters: None
 # Returns: None
 
-def publish(red, green):
-    client = paho.Client(client_id="publisher", protocol=paho.MQTTv5)
-    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
-    client.username_pw_set("MQTTpi", "Magicgambit10")
+def start_model():
+    load_model(DETECTOR_WEIGHTS)
+    warm_up_model(ROI_SIZE)
 
-    client.connect("dc3a7b985e0541f69572b6ccc2ff6a0c.s1.eu.hivemq.cloud", 8883)
-    client.loop_start()
+# Parameters: None
+# Returns: Instance of pygame screen class
 
-    # Publish a message to the test topic
-    payload = str(red) + ' ' + str(green)
-    client.publish("test/topic", payload=payload, qos=1)
+def start_display():
+    pygame.init()
+    return initialize_display(SCREEN_WIDTH, SCREEN_HEIGHT)
 
-    client.loop_stop()  # Stop the loop if you're done publishing
-    client.disconnect()
+# Parameters: parsed command line arguments
+# Returns: None, the slow components keep loading in the background
 
-def publish_pos(fen):
-    client = paho.Client(client_id="publisher", protocol=paho.MQTTv5)
-    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
-    client.username_pw_set("fensetup", "Magicgambit10")
+def start_app(args):
+    global startup, window
+    startup = Startup()
+    startup.run('camera', start_camera, args.record, args.replay, not args.replay_fast, args.record_width)
+    startup.run('model', start_model)
+    startup.run('engine', engine_service.start)
+    startup.run('mqtt', connect_brokers)
+    # pygame has to run on the main thread
+    window = startup.run_here('display', start_display)
 
-    client.connect("c424fde2a0ed48538e2b798a0d0e4c38.s1.eu.hivemq.cloud", 8883)
-    client.loop_start()
+# Parameters: Instance of pygame screen class
+# Returns: None, waits for the background components while keeping the window responsive
+
+def wait_for_startup(screen):
+    global camera, calibration
+    if camera is not None:
+        return
+    if not startup.done():
+        layer = ui_layer(screen, 'loading')
+        draw_centered_text(layer, 'loading', "LOADING", CLOCK_FONT_SIZE, (screen.get_width() // 2, screen.get_height() // 2))
+        layer.flip()
+        while not startup.done():
+            for event in wait_for_events(.1):
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+    for name in ('model', 'engine', 'mqtt'):
+        startup.result(name)
+    camera, calibration = startup.result('camera')
+    startup.mark('game ready')
+    metrics.log(logging.INFO, 'startup', **startup.timings())
+
+# Posted by the game's worker thread when a stage has finished
+GAME_EVENT = pygame.USEREVENT + 2
+# How often the motion gate looks at the camera during the player's turn
+MOTION_POLL_INTERVAL = .04
+# Player moves since the board was last checked for drift
+moves_since_check = 0
+
+# Parameters: Instance of chess.Board, positions before and after the bot's last move,
+#             monotonic time float, threading.Event set when the game ends
+# Returns: Instance of chess.Board after the player's move or None if the player has not moved
+
+def recognize_move(game_board, unmoved_boards, newer_than, cancelled):
+    with metrics.timer('recognition'):
+        return read_player_move(game_board, unmoved_boards, newer_than, cancelled)
+
+# Parameters: same as recognize_move
+# Returns: same as recognize_move
+
+def read_player_move(game_board, unmoved_boards, newer_than, cancelled):
+    global calibration, moves_since_check
+    if moves_since_check >= DRIFT_CHECK_INTERVAL:
+        moves_since_check = 0
+        calibration = check_calibration(camera, calibration, newer_than)
+    game_board = game_board.copy()
+    move, confidence = read_move(camera, calibration, game_board, newer_than, FUSION_WINDOW,
+                                 MOVE_CONFIDENCE, ROI_SIZE, unmoved_boards)
+    if confidence >= MOVE_CONFIDENCE:
+        if move is None:
+            # Only the bot's move was played on the board, keep waiting for the player
+            metrics.log(logging.INFO, 'no player move detected')
+            return None
+        metrics.log(logging.INFO, 'player move', move=move.uci(), confidence=round(confidence, 2))
+        moves_since_check += 1
+        game_board.push(move)
+        record_event(camera, 'settled', fen=game_board.board_fen(), frame_time=newer_than)
+        return game_board
+    metrics.log(logging.INFO, 'uncertain player move, reading the whole board', confidence=round(confidence, 2))
+    metrics.count('recognition.fallbacks')
+    pos = None
+    while pos is None:
+        if cancelled.is_set():
+            return None
+        pos = read_frame_fused(camera, calibration, newer_than, FUSION_WINDOW, FUSION_CONFIDENCE, show_string=True, roi_size=ROI_SIZE)
+        if pos is None:
+            metrics.log(logging.INFO, 'failed to locate kings')
+            if replay_finished(camera):
+                raise ReplayFinished("replay ended before the player's move was recognized")
+    if pos in [unmoved.board_fen() for unmoved in unmoved_boards]:
+        metrics.log(logging.INFO, 'no player move detected')
+        return None
+    moves_since_check += 1
+    record_event(camera, 'settled', fen=pos, frame_time=newer_than)
+    # The bot is to move after the player
+    return chess.Board(pos + ' ' + ('b' if game_board.turn == chess.WHITE else 'w'))
 
-    # Publish a message to the test topic
-    client.publish("test/fen", payload=fen, qos=1)
+# Parameters: None
+# Returns: None, exits once a replay has nothing left to play
+
+def end_replay():
+    metrics.log(logging.INFO, 'replay finished')
+    metrics.log(logging.INFO, 'ui ' + frame_timer.summary())
+    pygame.quit()
+    sys.exit()
+
+# Worker for the game's slow stages, one at a time
+bot_executor = ThreadPoolExecutor(max_workers=1)
 
-    client.loop_stop()  # Stop the loop if you're done publishing
-    client.disconnect()
-# -------------------------------------------------------------------------- MAIN -----------------------------------------------------------------------------
-# Threshold values for piece detection
-piece_threshold = {
-    'k': .01, #.01
-    'p': .3, #.3
-    'n': .1, #.1
-    'b': .5, #.5
-    'r': .4, #.4
-    'q': .3, #.3
-    'K': .2, #.2
-    'P': .2, #.2
-    'N': .4, #.4
-    'B': .1, #.1
-    'R': .05, #.05
-    'Q': .01, #.01
-}
-# Camera setup
-camera = initialize_camera()
-
-IMAGE_X, IMAGE_Y = 480,480
-# YOLO model setup
-model = YOLOv10('best.pt')
-game_over = None
-# pygame initialization
-window = initialize_display(SCREEN_WIDTH, SCREEN_HEIGHT)
 def main():
-    global window, time_map, is_bot_turn, camera
+    global window, time_map, camera, calibration
     # main setup
-    game_over = False
+    engine_service.new_game()
     diff, bot_color, time_control = get_settings(window)
-    window.fill((30, 30, 30))
-    seconds = time_map[time_control]
-
-    if bot_color == 'w':
-        is_bot_turn = True
-    else:
-        is_bot_turn = False
-
-    clock = pygame.time.Clock()
-    win = False
-    while not game_over:
-        # bot move
-        if is_bot_turn:
-            # [top left, top right, bottom left, bottom right]
-            clock.tick(1)
-            x = display_timer(window, round(seconds))
-            if x != None:
-                return
-            legal_pos = False
-            while not legal_pos:
-                board_corners = [[130, 270], [553, 61], [448, 667], [923, 343]]
-                board_corners = initial_convert(board_corners)
-                img = get_frame(camera)
-                pos = read_frame(img, board_corners, True)
-                if pos.count('k') != 1 or pos.count('K') != 1:
-                    print('Failed to locate kings')
-                    time.sleep(.5)
-                    continue
-                legal_pos = True
-            # player checkmate
-            publish_pos(pos)
-            board = chess.Board(pos)
-            if chess.Board(pos).is_checkmate():
-                game_over = True
-                win = True
-                break
-            response = get_bot_move_from_fen(pos, diff, bot_color)
-            board = chess.Board(pos + ' ' + bot_color)
-            board.push(response)
-            publish_pos(board.board_fen())
-            # bot checkmate
-            if board.is_checkmate():
-                game_over = True
-                win = False
-
-            r = square_to_LED(response.from_square)
-            g = square_to_LED(response.to_square)
-            publish(r,g)
-
-            is_bot_turn = False
-        # player move
-        else:
-            clock.tick(25)
-            seconds -= .04
-            # time control
-            if seconds <= 0:
-                game_over = True
-                win = False
-            x = display_timer(window, round(seconds))
-            if x != None:
-                return
-
-        pygame.display.update()
+    wait_for_startup(window)
+    bot = ChessBot(diff)
+    game = GameMachine(bot, recognize_move, publish_board, bot_color, time_map[time_control], bot_executor,
+                       lambda: pygame.event.post(pygame.event.Event(GAME_EVENT)))
+
+    gate = MotionGate(MOVE_SETTLE_TIME)
+    last_gate_frame = None
+    state = None
+    events = []
+    frame_timer.reset()
+    game.start()
     while True:
-        x = display_end(window, win)
-        if x != None:
+        frame_timer.start()
+        try:
+            game.process()
+        except ReplayFinished:
+            game.cancel()
+            end_replay()
+        if game.is_over():
             break
-
-while True:
-    main()
\ No newline at end of file
+        if game.state != state:
+            state = game.state
+            if game.player_turn():
+                # The board may have been recalibrated during the bot's turn
+                gate.set_board(calibration)
+                gate.reset()
+        x = display_timer(window, max(0, math.ceil(game.player_time())), game.player_turn(), events)
+        if x == 'restart':
+            game.cancel()
+            metrics.log(logging.INFO, 'ui ' + frame_timer.summary())
+            return
+        if x == 'confirm':
+            game.confirm_move(time.monotonic())
+        if AUTO_MOVE_DETECTION and game.player_turn():
+            timestamp, frame = camera.latest()
+            if frame is not None and timestamp != last_gate_frame:
+                last_gate_frame = timestamp
+                if gate.update(timestamp, frame):
+                    game.confirm_move(gate.settled_at)
+            if game.player_turn() and replay_finished(camera):
+                # The gate has seen the last frame and no move came of it
+                game.cancel()
+                end_replay()
+        frame_timer.stop(ui.drew)
+
+        # Sleep until input, a finished stage, the next clock second or the next camera check
+        timeout = game.timeout()
+        if game.state != state:
+            timeout = 0
+        elif AUTO_MOVE_DETECTION and game.player_turn():
+            timeout = MOTION_POLL_INTERVAL if timeout is None else min(timeout, MOTION_POLL_INTERVAL)
+        events = wait_for_events(timeout)
+    metrics.log(logging.INFO, 'ui ' + frame_timer.summary())
+    events = []
+    while display_end(window, game.won, events) is None:
+        events = wait_for_events()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Magic Gambit")
+    parser.add_argument('--record', help="record camera frames and game events to this path")
+    parser.add_argument('--record-width', type=int, help="downscale recorded frames to this width to save space, "
+                        "such replays do not show recognition what the camera does")
+    parser.add_argument('--replay', help="play a recording instead of the camera")
+    parser.add_argument('--replay-fast', action='store_true', help="replay frames as fast as they are read")
+    parser.add_argument('--log-level', default='INFO', help="DEBUG also logs every detection box, WARNING only problems")
+    parser.add_argument('--log-file', help="also write the log to this file as JSON lines")
+    parser.add_argument('--metrics', action='store_true', help="collect stage timers and counters")
+    parser.add_argument('--metrics-port', type=int, help="serve the timers and counters on http://localhost:PORT/metrics")
+    args = parser.parse_args()
+    if args.record is not None and any(os.path.exists(path) for path in recording_paths(args.record)):
+        parser.error("recording {} already exists, record to a new name".format(args.record))
+    metrics.configure(args.metrics, args.log_level, args.log_file, args.metrics_port)
+    start_app(args)
+    while True:
+        main()
\ No newline at end of file
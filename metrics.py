@@ -0,0 +1,198 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import collections
+import contextlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Timers, counters and structured log events for the game. Everything is off until
+# configure() turns it on: timer() then hands back a shared do-nothing context and count()
+# and observe() return right away, and log() checks the level before formatting anything.
+#
+#   with metrics.timer('inference'):
+#       ...
+#   metrics.count('recognition.retries')
+#   metrics.log(logging.INFO, 'player move', move='e2e4', confidence=.97)
+
+logger = logging.getLogger('magic_gambit')
+enabled = False
+
+# Keeps the last window values of one measurement
+class RollingHistogram:
+    def __init__(self, window=500):
+        self.values = collections.deque(maxlen=window)
+        self.total = 0
+
+    # Parameters: Instance of RollingHistogram, value float
+    # Returns: None
+
+    def add(self, value):
+        self.values.append(value)
+        self.total += 1
+
+    # Parameters: Instance of RollingHistogram
+    # Returns: dict of count and mean, percentiles and max of the window
+
+    def snapshot(self):
+        if not self.values:
+            return {'count': self.total}
+        values = np.array(self.values)
+        return {'count': self.total, 'mean': float(np.mean(values)), 'p50': float(np.percentile(values, 50)),
+                'p90': float(np.percentile(values, 90)), 'p99': float(np.percentile(values, 99)),
+                'max': float(np.max(values))}
+
+# Counters and rolling histograms by name, safe to use from any thread
+class Metrics:
+    def __init__(self, window=500):
+        self.window = window
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.histograms = {}
+
+    # Parameters: Instance of Metrics, counter name, amount int
+    # Returns: None
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    # Parameters: Instance of Metrics, histogram name, value float
+    # Returns: None
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingHistogram(self.window)
+            histogram.add(value)
+
+    # Parameters: Instance of Metrics
+    # Returns: dict of counters and histogram summaries (times in milliseconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'histograms_ms': {name: {key: value * 1000 if key != 'count' else value
+                                             for key, value in histogram.snapshot().items()}
+                                      for name, histogram in self.histograms.items()}}
+
+    # Parameters: Instance of Metrics
+    # Returns: None
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+registry = Metrics()
+
+class Timer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+NULL_TIMER = contextlib.nullcontext()
+
+# Parameters: histogram name
+# Returns: context manager that records how long its block took
+
+def timer(name):
+    return Timer(name) if enabled else NULL_TIMER
+
+# Parameters: counter name, amount int
+# Returns: None
+
+def count(name, n=1):
+    if enabled:
+        registry.count(name, n)
+
+# Parameters: histogram name, duration in seconds float
+# Returns: None
+
+def observe(name, seconds):
+    if enabled:
+        registry.observe(name, seconds)
+
+# Parameters: logging level int, event name string, event fields
+# Returns: None
+
+def log(level, event, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+# One JSON object per line: time, level, event and its fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+# Human readable console lines, "event key=value ..."
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        return ' '.join([record.getMessage()] + ['{}={}'.format(key, value) for key, value in fields.items()])
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = json.dumps(registry.snapshot(), indent=2).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Parameters: port int, bind address
+# Returns: the running HTTP server, GET /metrics answers with the registry snapshot
+
+def serve(port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Parameters: collect timers and counters boolean, logging level name or int, JSON lines log file path or None,
+#             metrics endpoint port or None, histogram window int
+# Returns: None
+
+def configure(collect=False, level='INFO', log_path=None, port=None, window=500):
+    global enabled
+    enabled = collect or port is not None
+    registry.window = window
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    console = logging.StreamHandler()
+    console.setFormatter(TextFormatter())
+    logger.addHandler(console)
+    if log_path is not None:
+        structured = logging.FileHandler(log_path)
+        structured.setFormatter(JsonFormatter())
+        logger.addHandler(structured)
+    if port is not None:
+        serve(port)
+
+# Until configure() is called, events from INFO up go to the console like the prints they replace
+configure()
@@ -8,24 +8,32 @@ import paho.mqtt.client as paho
 import ssl
 import pygame
 import threading
+import logging
+import metrics
+from renderer import BOARD_UPDATE, BoardRenderer
+from protocol import BOARD_TOPIC, SequenceTracker, decode
 
-# Global variable to store the current board state
-current_piece_list = [[]]
+# Drops board messages that arrive after a newer one
+tracker = SequenceTracker()
 
 def on_connect(client, userdata, flags, rc, properties=None):
-    print("Connected with result code " + str(rc))
-    client.subscribe("test/fen")  # Subscribe to a test topic
+    metrics.log(logging.INFO, 'connected', rc=str(rc))
+    client.subscribe(BOARD_TOPIC)  # Subscribe to the board topic
 
 def on_message(client, userdata, message):
-    global current_piece_list
-    # Decode the FEN string from the received MQTT message
-    fen = message.payload.decode()
-    print('message received')
-    if len(fen) > 10:
-        print(f"Received FEN: {fen} on topic {message.topic}")
-
-        # Convert the FEN string to a 2D list (array)
-        current_piece_list = FEN_to_array(fen)
+    # Decode the board message received over MQTT
+    try:
+        frame = decode(message.payload)
+    except ValueError as error:
+        metrics.log(logging.WARNING, 'ignoring message', topic=message.topic, error=str(error))
+        return
+    if not tracker.accept(frame):
+        metrics.log(logging.INFO, 'dropping stale board', seq=frame.seq)
+        return
+    metrics.log(logging.INFO, 'received board', fen=frame.fen, topic=message.topic)
+
+    # Hand the board to the display loop, pygame's event queue is thread safe
+    pygame.event.post(pygame.event.Event(BOARD_UPDATE, fen=frame.fen))
 
 def display_board():
     pygame.init()
@@ -34,42 +42,32 @@ def display_board():
 
     screen_width, screen_height = screen.get_size()
     square_size = min(screen_width, screen_height) // 8
+    renderer = BoardRenderer(screen, square_size)
+    piece_list = FEN_to_array("8/8/8/8/8/8/8/8")  # Start with an empty board
+    renderer.update(piece_list)
+
+    # Only wake up for events that change what is shown
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.VIDEOEXPOSE, BOARD_UPDATE])
+
+    # Start the MQTT client in a separate thread once the event queue exists
+    mqtt_thread = threading.Thread(target=start_mqtt, daemon=True)
+    mqtt_thread.start()
 
     running = True
     while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT:
+            running = False
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
                 running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    running = False
-
-        for row in range(8):
-            for col in range(8):
-                # Determine the color of the tile
-                if (row + col) % 2 == 0:
-                    color = (227, 193, 111)
-                else:
-                    color = (184, 139, 74)
-
-                # Draw the tile
-                pygame.draw.rect(screen, color,
-                                 pygame.Rect(col * square_size, row * square_size, square_size, square_size))
-
-                # Draw the piece, if any
-                piece = current_piece_list[row][col]
-                if piece != '':
-                    if piece.upper() == piece:
-                        piece_image = r'pieces\w' + piece.lower() + '.png'
-                    else:
-                        piece_image = r'pieces\b' + piece.lower() + '.png'
-                    piece_image = pygame.image.load(piece_image)
-                    piece_image = pygame.transform.scale(piece_image, (square_size, square_size))
-                    piece_rect = piece_image.get_rect(
-                        center=(col * square_size + square_size // 2, row * square_size + square_size // 2))
-                    screen.blit(piece_image, piece_rect)
-
-        pygame.display.flip()
+        elif event.type == BOARD_UPDATE:
+            piece_list = FEN_to_array(event.fen)
+            renderer.update(piece_list)
+        elif event.type == pygame.VIDEOEXPOSE:
+            renderer.invalidate()
+            renderer.update(piece_list)
 
     pygame.quit()
 
@@ -97,10 +95,5 @@ def start_mqtt():
 
     client.loop_forever()  # Run the MQTT loop continuously
 
-# Start the MQTT client in a separate thread
-mqtt_thread = threading.Thread(target=start_mqtt)
-mqtt_thread.start()
-
 # Start the Pygame display loop in fullscreen mode
-current_piece_list = FEN_to_array("8/8/8/8/8/8/8/8")  # Start with an empty board
 display_board()
\ No newline at end of file
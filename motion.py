@@ -0,0 +1,107 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import cv2
+import numpy as np
+
+# Watches downscaled frames of the board during the player's turn. A move is reported
+# once something has moved over the board (a hand), the scene has then been still for
+# settle_time seconds, and the still scene differs a little, but not a lot, from the one
+# before the motion. A large difference means a hand is still resting over the board.
+class MotionGate:
+    def __init__(self, settle_time=1.0, width=160, pixel_threshold=25, motion_threshold=.02,
+                 change_threshold=.005, occlusion_threshold=.2):
+        self.settle_time = settle_time
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        self.change_threshold = change_threshold
+        self.occlusion_threshold = occlusion_threshold
+        self.mask = None
+        self.calibration = None
+        self.reset()
+
+    # Parameters: Instance of MotionGate, Instance of BoardCalibration
+    # Returns: None
+
+    def set_board(self, calibration):
+        self.calibration = calibration
+        self.mask = None
+
+    # Parameters: Instance of MotionGate
+    # Returns: None
+
+    def reset(self):
+        self.state = 'idle'
+        self.previous = None
+        self.reference = None
+        self.still_since = None
+        self.settled_at = None
+
+    # Parameters: Instance of MotionGate, 2D array of frame
+    # Returns: downscaled, blurred grayscale frame
+
+    def _prepare(self, frame):
+        height = int(frame.shape[0] * self.width / frame.shape[1])
+        small = cv2.cvtColor(cv2.resize(frame, (self.width, height)), cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        if self.mask is None:
+            self.mask = np.zeros(small.shape, dtype=bool)
+            if self.calibration is None:
+                self.mask[:] = True
+            else:
+                corners = self.calibration.frame_corners((self.width, height))
+                polygon = np.zeros(small.shape, dtype=np.uint8)
+                # Corners are [top left, top right, bottom left, bottom right]
+                cv2.fillConvexPoly(polygon, corners[[0, 1, 3, 2]].astype(np.int32), 1)
+                self.mask = polygon.astype(bool)
+        return small
+
+    # Parameters: Instance of MotionGate, two downscaled frames
+    # Returns: share of the board region that differs between them
+
+    def _difference(self, a, b):
+        changed = cv2.absdiff(a, b) > self.pixel_threshold
+        return np.count_nonzero(changed & self.mask) / max(1, np.count_nonzero(self.mask))
+
+    # Parameters: Instance of MotionGate, monotonic capture time float, 2D array of frame
+    # Returns: True once when a move has been made and the board has settled
+
+    def update(self, timestamp, frame):
+        small = self._prepare(frame)
+        if self.previous is None:
+            self.previous = small
+            self.reference = small
+            return False
+        motion = self._difference(small, self.previous)
+        self.previous = small
+
+        if self.state == 'idle':
+            if motion > self.motion_threshold:
+                self.state = 'moving'
+                self.still_since = None
+            return False
+
+        if motion > self.motion_threshold:
+            self.still_since = None
+            return False
+        if self.still_since is None:
+            self.still_since = timestamp
+            return False
+        if timestamp - self.still_since < self.settle_time:
+            return False
+
+        change = self._difference(small, self.reference)
+        if change > self.occlusion_threshold:
+            # Still, but something large is covering the board
+            return False
+        self.state = 'idle'
+        self.reference = small
+        if change < self.change_threshold:
+            # The hand left without moving anything
+            return False
+        self.settled_at = self.still_since
+        return True
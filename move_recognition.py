@@ -0,0 +1,49 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import chess
+import numpy as np
+
+from fusion import CLASS_INDEX
+
+# Parameter: Instance of Board class
+# Returns: array of 64 indices into PIECE_CLASSES, row by row from a8 like a FEN
+
+def board_labels(board):
+    labels = np.empty(64, dtype=int)
+    for row in range(8):
+        for col in range(8):
+            piece = board.piece_at(chess.square(col, 7 - row))
+            labels[row * 8 + col] = CLASS_INDEX[piece.symbol() if piece else '']
+    return labels
+
+# Scores every legal move from the last known position against per-square class
+# probabilities from the camera. The position after a move must explain what the camera
+# sees, so only the ~30 legal successors compete instead of every possible board.
+
+# Parameters: Instance of Board class before the player's move, 64xN array of class probabilities,
+#             list of Board instances that mean no move was made yet
+# Returns: best Instance of Move class (None if no move was made), confidence float
+
+def score_moves(board, probabilities, unmoved_boards=()):
+    log_p = np.log(np.asarray(probabilities) + 1e-6)
+    candidates = list(board.legal_moves)
+    labels = []
+    for move in candidates:
+        board.push(move)
+        labels.append(board_labels(board))
+        board.pop()
+    for unmoved in unmoved_boards:
+        candidates.append(None)
+        labels.append(board_labels(unmoved))
+    if not candidates:
+        return None, 0.0
+
+    scores = log_p[np.arange(64), np.array(labels)].sum(axis=1)
+    # Share of the total likelihood taken by the best candidate
+    weights = np.exp(scores - np.max(scores))
+    best = int(np.argmax(scores))
+    return candidates[best], float(weights[best] / np.sum(weights))
@@ -0,0 +1,150 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import atexit
+import collections
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+
+import paho.mqtt.client as paho
+
+import metrics
+
+# Handed back by MqttPublisher.publish(), completes once the broker acknowledged the message
+class Delivery:
+    def __init__(self, topic, payload, qos):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.delivered = False
+        self.event = threading.Event()
+
+    # Parameters: Instance of Delivery, delivered boolean
+    # Returns: None
+
+    def complete(self, delivered):
+        self.delivered = delivered
+        self.event.set()
+
+    # Parameters: Instance of Delivery, timeout in seconds
+    # Returns: True if the broker acknowledged the message
+
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+        return self.delivered
+
+# One long-lived TLS connection to a broker. Messages go into a bounded queue and are sent
+# in order by a background thread, so publish() never waits on the network. While the
+# connection is down messages stay queued and paho keeps reconnecting; when the queue is
+# full the oldest message is dropped. The broker disconnects a client when another one
+# connects with the same id, so the default id is unique per host and process.
+class MqttPublisher:
+    def __init__(self, host, username, password, client_id=None, port=8883, maxsize=100):
+        if client_id is None:
+            client_id = "publisher-{}-{}".format(socket.gethostname(), os.getpid())
+        self.maxsize = maxsize
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.connected = threading.Event()
+        self.running = True
+
+        self.host = host
+        self.client = paho.Client(client_id=client_id, protocol=paho.MQTTv5)
+        self.client.tls_set(tls_version=ssl.PROTOCOL_TLS)
+        self.client.username_pw_set(username, password)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            metrics.log(logging.INFO, 'mqtt connected', host=self.host)
+            self.connected.set()
+        else:
+            metrics.log(logging.WARNING, 'mqtt connection failed', host=self.host, rc=str(rc))
+
+    def _on_disconnect(self, client, userdata, *args):
+        if self.connected.is_set():
+            metrics.log(logging.WARNING, 'mqtt disconnected', host=self.host)
+            metrics.count('mqtt.disconnects')
+        self.connected.clear()
+
+    # Parameters: Instance of MqttPublisher, topic string, payload string or bytes, qos int
+    # Returns: Instance of Delivery
+
+    def publish(self, topic, payload, qos=1):
+        delivery = Delivery(topic, payload, qos)
+        with self.condition:
+            if len(self.queue) >= self.maxsize:
+                self.queue.popleft().complete(False)
+                metrics.count('mqtt.dropped')
+            self.queue.append(delivery)
+            self.condition.notify()
+        return delivery
+
+    # Parameters: Instance of MqttPublisher
+    # Returns: None
+
+    def _send_loop(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                delivery = self.queue.popleft()
+            start = time.perf_counter()
+            if self._send(delivery):
+                metrics.observe('mqtt.publish', time.perf_counter() - start)
+                metrics.count('mqtt.published')
+                delivery.complete(True)
+                continue
+            metrics.count('mqtt.retries')
+            # Not sent, put it back in front and wait for the connection
+            with self.condition:
+                self.queue.appendleft(delivery)
+                while len(self.queue) > self.maxsize:
+                    self.queue.pop().complete(False)
+                    metrics.count('mqtt.dropped')
+            self.connected.wait(1)
+
+    # Parameters: Instance of MqttPublisher, Instance of Delivery
+    # Returns: True if the broker acknowledged the message
+
+    def _send(self, delivery):
+        if not self.connected.wait(1):
+            return False
+        try:
+            info = self.client.publish(delivery.topic, payload=delivery.payload, qos=delivery.qos)
+            info.wait_for_publish(timeout=5)
+            return info.is_published()
+        except (RuntimeError, ValueError):
+            return False
+
+    # Parameters: Instance of MqttPublisher, seconds to wait for queued messages
+    # Returns: None
+
+    def close(self, timeout=2):
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        while self.queue and self.connected.is_set() and time.monotonic() < deadline:
+            time.sleep(.05)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.client.disconnect()
+        self.client.loop_stop()
@@ -1,24 +1,18 @@
-import paho.mqtt.client as paho
-import ssl
-import time
+from mqtt_client import MqttPublisher
+from protocol import BOARD_TOPIC, MessageEncoder, highlight_frame
 
-def publish(red, green):
-    client = paho.Client(client_id="publisher", protocol=paho.MQTTv5)
-    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
-    client.username_pw_set("MQTTpi", "Magicgambit10")
-
-    client.connect("dc3a7b985e0541f69572b6ccc2ff6a0c.s1.eu.hivemq.cloud", 8883)
-    client.loop_start()
+publisher = MqttPublisher("dc3a7b985e0541f69572b6ccc2ff6a0c.s1.eu.hivemq.cloud", "MQTTpi", "Magicgambit10")
+encoder = MessageEncoder()
 
-    # Publish a message to the test topic
-    payload = str(red) + ' ' + str(green)
-    client.publish("test/topic", payload=payload, qos=1)
-
-    client.loop_stop()  # Stop the loop if you're done publishing
-    client.disconnect()
+def publish(red, green):
+    # Publish a board message lighting two squares
+    payload = encoder.encode("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR", highlight_frame(red, green))
+    return publisher.publish(BOARD_TOPIC, payload)
 
-# LED indices from 0-63 (inclusive)
+# Square indices from 0-63 (inclusive), a1 = 0
 LED_A = 5
 LED_B = 10
 
-publish(LED_A, LED_B)
+delivery = publish(LED_A, LED_B)
+print("Delivered" if delivery.wait(10) else "Not delivered")
+publisher.close()
@@ -1,12 +1,19 @@
 import paho.mqtt.client as paho
 import ssl
+from protocol import BOARD_TOPIC, decode
 
 def on_connect(client, userdata, flags, rc, properties=None):
     print("Connected with result code " + str(rc))
-    client.subscribe("test/topic")  # Subscribe to a test topic
+    client.subscribe(BOARD_TOPIC)  # Subscribe to the board topic
 
 def on_message(client, userdata, message):
-    print(f"Received message: {message.payload.decode()} on topic {message.topic}")
+    try:
+        frame = decode(message.payload)
+    except ValueError as error:
+        print(f"Received undecodable message ({error}) on topic {message.topic}")
+        return
+    lit = [square for square, color in enumerate(frame.leds) if color]
+    print(f"Received board #{frame.seq} {frame.fen} flags {frame.flags} LEDs {lit} on topic {message.topic}")
 
 client = paho.Client(client_id="subscriber", protocol=paho.MQTTv5)
 client.tls_set(tls_version=ssl.PROTOCOL_TLS)
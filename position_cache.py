@@ -0,0 +1,88 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import sqlite3
+import threading
+import time
+
+import chess
+import chess.polyglot
+
+# Parameter: Instance of Board class
+# Returns: signed 64-bit Zobrist hash that fits an SQLite integer
+
+def position_key(board):
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+# Bot moves already played from a position, keyed by position hash and difficulty level.
+# Stored in SQLite so several boards on the same host can share one file, and bounded to
+# max_entries by dropping the least recently used positions. Misses can fall back to a
+# Polyglot opening book, whose moves are then cached like any other.
+class PositionCache:
+    def __init__(self, path='positions.db', max_entries=100000, book_path=None, book_min_level=3):
+        self.max_entries = max_entries
+        self.book_min_level = book_min_level
+        self.book = chess.polyglot.open_reader(book_path) if book_path else None
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        # WAL lets other boards read while one of them writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS positions ("
+                          "key INTEGER NOT NULL, level INTEGER NOT NULL, move TEXT NOT NULL, last_used REAL NOT NULL, "
+                          "PRIMARY KEY (key, level)) WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS positions_last_used ON positions (last_used)")
+
+    # Parameters: Instance of PositionCache, instance of Board class, level int
+    # Returns: Instance of Move class or None
+
+    def get(self, board, level):
+        key = position_key(board)
+        with self.lock:
+            row = self.conn.execute("SELECT move FROM positions WHERE key = ? AND level = ?", (key, level)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE positions SET last_used = ? WHERE key = ? AND level = ?", (time.time(), key, level))
+        if row is not None:
+            move = chess.Move.from_uci(row[0])
+            if move in board.legal_moves:
+                return move
+        if self.book is not None and level >= self.book_min_level:
+            entry = self.book.get(board)
+            if entry is not None:
+                self.put(board, level, entry.move)
+                return entry.move
+        return None
+
+    # Parameters: Instance of PositionCache, instance of Board class, level int, Instance of Move class
+    # Returns: None
+
+    def put(self, board, level, move):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO positions (key, level, move, last_used) VALUES (?, ?, ?, ?)",
+                              (position_key(board), level, move.uci(), time.time()))
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self._evict()
+
+    # Parameters: Instance of PositionCache
+    # Returns: None
+
+    def _evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute("DELETE FROM positions WHERE (key, level) IN "
+                              "(SELECT key, level FROM positions ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+
+    # Parameters: Instance of PositionCache
+    # Returns: None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+            if self.book is not None:
+                self.book.close()
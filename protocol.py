@@ -0,0 +1,171 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import collections
+import itertools
+import random
+import struct
+import time
+
+# Binary board message sent on BOARD_TOPIC, one per position (83 bytes):
+#   header  magic 'MG', version, message type, session id (uint16), sequence (uint32),
+#           wall clock timestamp (float64), all big endian
+#   body    flags byte, 64 squares of 4 bit piece codes, 64 squares of 4 bit LED colors
+# Squares are numbered like python-chess, a1 = 0 ... h8 = 63. The session id is random per
+# publisher start, so subscribers can tell a restart from an old, out of order message.
+BOARD_TOPIC = "test/board"
+MAGIC = b'MG'
+VERSION = 1
+BOARD_MESSAGE = 1
+
+HEADER = struct.Struct('>2sBBHId')
+BODY = struct.Struct('>B32s32s')
+
+# Flags
+WHITE_TO_MOVE = 1
+CHECK = 2
+GAME_OVER = 4
+
+# Piece codes, 0 is an empty square
+PIECES = ' PNBRQK  pnbrqk'
+PIECE_CODES = {char: i for i, char in enumerate(PIECES) if char != ' '}
+
+# LED palette, a frame stores one of these indices per square
+LED_OFF = 0
+LED_FROM = 1
+LED_TO = 2
+LED_CHECK = 3
+LED_COLORS = [(0, 0, 0), (255, 0, 0), (0, 255, 0), (255, 80, 0)]
+
+BoardMessage = collections.namedtuple('BoardMessage', ['session', 'seq', 'timestamp', 'flags', 'fen', 'leds'])
+
+# Parameters: list of 64 ints 0-15
+# Returns: 32 bytes, two squares per byte
+
+def pack_nibbles(values):
+    return bytes((values[i] << 4) | values[i + 1] for i in range(0, 64, 2))
+
+# Parameters: 32 bytes
+# Returns: list of 64 ints 0-15
+
+def unpack_nibbles(data):
+    values = []
+    for byte in data:
+        values.extend((byte >> 4, byte & 15))
+    return values
+
+# Parameters: board FEN string (piece placement only)
+# Returns: list of 64 piece codes
+
+def fen_to_codes(fen):
+    codes = [0] * 64
+    for rank, row in enumerate(fen.split(' ')[0].split('/')):
+        file = 0
+        for char in row:
+            if char.isdigit():
+                file += int(char)
+            else:
+                codes[(7 - rank) * 8 + file] = PIECE_CODES[char]
+                file += 1
+    return codes
+
+# Parameters: list of 64 piece codes
+# Returns: board FEN string
+
+def codes_to_fen(codes):
+    rows = []
+    for rank in range(7, -1, -1):
+        row, empty = '', 0
+        for code in codes[rank * 8:rank * 8 + 8]:
+            if code == 0:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            row += PIECES[code]
+        rows.append(row + (str(empty) if empty else ''))
+    return '/'.join(rows)
+
+# Parameters: from square, to square and square of a king in check, each int or None
+# Returns: list of 64 LED palette indices
+
+def highlight_frame(from_square=None, to_square=None, check_square=None):
+    leds = [LED_OFF] * 64
+    if check_square is not None:
+        leds[check_square] = LED_CHECK
+    if from_square is not None:
+        leds[from_square] = LED_FROM
+    if to_square is not None:
+        leds[to_square] = LED_TO
+    return leds
+
+# Parameters: session id int, sequence int, board FEN string, list of 64 LED palette indices,
+#             flags int, timestamp float or None for now
+# Returns: encoded message bytes
+
+def encode(session, seq, fen, leds=None, flags=0, timestamp=None):
+    if leds is None:
+        leds = highlight_frame()
+    if timestamp is None:
+        timestamp = time.time()
+    header = HEADER.pack(MAGIC, VERSION, BOARD_MESSAGE, session, seq & 0xFFFFFFFF, timestamp)
+    return header + BODY.pack(flags, pack_nibbles(fen_to_codes(fen)), pack_nibbles(leds))
+
+# Parameters: message bytes
+# Returns: Instance of BoardMessage, raises ValueError for anything that is not a board message
+
+def decode(payload):
+    if len(payload) != HEADER.size + BODY.size:
+        raise ValueError("Board message must be {} bytes, got {}".format(HEADER.size + BODY.size, len(payload)))
+    magic, version, kind, session, seq, timestamp = HEADER.unpack_from(payload)
+    if magic != MAGIC or kind != BOARD_MESSAGE:
+        raise ValueError("Not a board message")
+    if version != VERSION:
+        raise ValueError("Unsupported board message version " + str(version))
+    flags, board, leds = BODY.unpack_from(payload, HEADER.size)
+    return BoardMessage(session, seq, timestamp, flags, codes_to_fen(unpack_nibbles(board)), unpack_nibbles(leds))
+
+# Numbers the messages of one publisher
+class MessageEncoder:
+    def __init__(self, session=None):
+        self.session = random.getrandbits(16) if session is None else session
+        self.counter = itertools.count()
+
+    # Parameters: Instance of MessageEncoder, board FEN string, list of 64 LED palette indices, flags int
+    # Returns: encoded message bytes
+
+    def encode(self, fen, leds=None, flags=0):
+        return encode(self.session, next(self.counter), fen, leds, flags)
+
+# Drops messages that arrive after a newer one from the same publisher, messages of another
+# publisher session that are not newer than the last one accepted (e.g. a redelivery from
+# before a restart), and optionally messages older than max_age seconds
+class SequenceTracker:
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.session = None
+        self.seq = None
+        self.timestamp = None
+
+    # Parameters: Instance of SequenceTracker, Instance of BoardMessage
+    # Returns: True if the message is newer than everything accepted so far
+
+    def accept(self, message):
+        if self.max_age is not None and time.time() - message.timestamp > self.max_age:
+            return False
+        if message.session == self.session:
+            # Same publisher, compare sequence numbers wrap around safe
+            step = (message.seq - self.seq) & 0xFFFFFFFF
+            if step == 0 or step >= 0x80000000:
+                return False
+        elif self.timestamp is not None and message.timestamp <= self.timestamp:
+            # Sequence numbers of different sessions do not compare, their send times do
+            return False
+        self.session = message.session
+        self.seq = message.seq
+        self.timestamp = message.timestamp
+        return True
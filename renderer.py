@@ -0,0 +1,85 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import os
+
+import pygame
+
+LIGHT_SQUARE = (227, 193, 111)
+DARK_SQUARE = (184, 139, 74)
+PIECE_DIR = 'pieces'
+
+# Posted (with a fen attribute) by other threads, e.g. the MQTT callback, when a new
+# board should be drawn, so the display loop can sleep in pygame.event.wait()
+BOARD_UPDATE = pygame.USEREVENT + 1
+
+# Piece sprites loaded and scaled to one square once, instead of per frame
+class SpriteAtlas:
+    def __init__(self, square_size, directory=PIECE_DIR):
+        self.sprites = {}
+        for piece in 'KQRBNPkqrbnp':
+            color = 'w' if piece.isupper() else 'b'
+            image = pygame.image.load(os.path.join(directory, color + piece.lower() + '.png'))
+            if image.get_size() != (square_size, square_size):
+                image = pygame.transform.smoothscale(image, (square_size, square_size))
+            # Match the display's pixel format so blits are plain copies
+            self.sprites[piece] = image.convert_alpha()
+
+    # Parameters: Instance of SpriteAtlas, piece character
+    # Returns: pygame Surface
+
+    def get(self, piece):
+        return self.sprites[piece]
+
+# Draws a board on a surface and remembers what is on every square, so each update only
+# redraws and flips the squares that changed
+class BoardRenderer:
+    def __init__(self, screen, square_size, origin=(0, 0), directory=PIECE_DIR):
+        self.screen = screen
+        self.square_size = square_size
+        self.origin = origin
+        self.atlas = SpriteAtlas(square_size, directory)
+        self.drawn = None
+
+    # Parameters: Instance of BoardRenderer
+    # Returns: None
+
+    def invalidate(self):
+        # Redraw every square on the next update, e.g. after the screen was cleared
+        self.drawn = None
+
+    # Parameters: Instance of BoardRenderer, 2D list of position
+    # Returns: list of pygame Rects that were redrawn
+
+    def draw(self, piece_list):
+        dirty = []
+        drawn = [[''] * 8 for _ in range(8)]
+        for row in range(8):
+            for col in range(8):
+                # Boards that are not 8x8 (e.g. a bad message) show the missing squares empty
+                piece = piece_list[row][col] if row < len(piece_list) and col < len(piece_list[row]) else ''
+                drawn[row][col] = piece
+                if self.drawn is not None and self.drawn[row][col] == piece:
+                    continue
+                rect = pygame.Rect(self.origin[0] + col * self.square_size, self.origin[1] + row * self.square_size,
+                                   self.square_size, self.square_size)
+                # Draw the tile
+                self.screen.fill(LIGHT_SQUARE if (row + col) % 2 == 0 else DARK_SQUARE, rect)
+                # Draw the piece, if any
+                if piece != '':
+                    self.screen.blit(self.atlas.get(piece), rect)
+                dirty.append(rect)
+        self.drawn = drawn
+        return dirty
+
+    # Parameters: Instance of BoardRenderer, 2D list of position
+    # Returns: list of pygame Rects that were redrawn
+
+    def update(self, piece_list):
+        dirty = self.draw(piece_list)
+        if dirty:
+            pygame.display.update(dirty)
+        return dirty
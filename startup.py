@@ -0,0 +1,63 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Starts independent components in parallel on background threads and records how long
+# each one took, plus named milestones since the start, for a cold start report.
+class Startup:
+    def __init__(self, workers=4):
+        self.started = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='startup')
+        self.tasks = {}
+        self.durations = {}
+        self.milestones = {}
+
+    # Parameters: Instance of Startup, component name, function, its arguments
+    # Returns: None
+
+    def run(self, name, fn, *args):
+        self.tasks[name] = self.executor.submit(self._timed, name, fn, *args)
+
+    # Parameters: Instance of Startup, component name, function, its arguments
+    # Returns: result of the function, run on the calling thread
+
+    def run_here(self, name, fn, *args):
+        return self._timed(name, fn, *args)
+
+    def _timed(self, name, fn, *args):
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            self.durations[name] = time.monotonic() - start
+
+    # Parameters: Instance of Startup, milestone name
+    # Returns: None
+
+    def mark(self, name):
+        self.milestones.setdefault(name, time.monotonic() - self.started)
+
+    # Parameters: Instance of Startup
+    # Returns: True once every background component has finished
+
+    def done(self):
+        return all(task.done() for task in self.tasks.values())
+
+    # Parameters: Instance of Startup, component name
+    # Returns: result of the component's function, waits for it and re-raises its error
+
+    def result(self, name):
+        return self.tasks[name].result()
+
+    # Parameters: Instance of Startup
+    # Returns: dict of seconds per component and seconds after start per milestone
+
+    def timings(self):
+        timings = {name: round(seconds, 2) for name, seconds in self.durations.items()}
+        timings.update({name.replace(' ', '_'): round(seconds, 2) for name, seconds in self.milestones.items()})
+        return timings
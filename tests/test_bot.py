@@ -0,0 +1,73 @@
+import threading
+import time
+
+import chess
+
+from bot import ChessBot
+
+
+class FakeAnalysis:
+    def __init__(self, infos):
+        self.infos = infos
+        self.stopped = threading.Event()
+
+    def __iter__(self):
+        yield from self.infos
+        # Like a real analysis, the iteration ends once the search is stopped
+        self.stopped.wait(5)
+
+    def stop(self):
+        self.stopped.set()
+
+
+# Engine whose analysis only starts once released, like one still busy with another search
+class BusyEngine:
+    def __init__(self, infos=()):
+        self.free = threading.Event()
+        self.analyses = []
+        self.infos = list(infos)
+
+    def analysis(self, board, limit, multipv=None):
+        self.free.wait(5)
+        analysis = FakeAnalysis(self.infos)
+        self.analyses.append(analysis)
+        return analysis
+
+    def play(self, board, limit):
+        return chess.engine.PlayResult(next(iter(board.legal_moves)), None)
+
+
+class FakeCache:
+    def get(self, board, level):
+        return None
+
+    def put(self, board, level, move):
+        pass
+
+
+def test_pondering_does_not_wait_for_a_busy_engine():
+    engine = BusyEngine()
+    bot = ChessBot(3, engine, FakeCache())
+    start = time.monotonic()
+    bot.start_pondering(chess.Board())
+    bot.stop_pondering()
+    assert time.monotonic() - start < 1
+    # Stopped before the engine was free, so the analysis is stopped as soon as it starts
+    engine.free.set()
+    bot.ponder_thread.join(5)
+    assert engine.analyses[0].stopped.is_set()
+
+
+def test_pondered_reply_is_played():
+    board = chess.Board()
+    player, reply = chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5')
+    engine = BusyEngine([{'depth': 3, 'pv': [player, reply]}])
+    engine.free.set()
+    bot = ChessBot(3, engine, FakeCache())
+    bot.start_pondering(board)
+    # Let the analysis report its line before the player's move comes in
+    deadline = time.monotonic() + 5
+    while not bot.ponder_replies and time.monotonic() < deadline:
+        time.sleep(.01)
+    board.push(player)
+    assert bot.choose_move(board) == reply
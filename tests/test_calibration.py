@@ -0,0 +1,49 @@
+import numpy as np
+
+from calibration import BoardCalibration
+
+CORNERS = [[130, 270], [553, 61], [448, 667], [923, 343]]
+
+
+# The per point lookup read_frame used before BoardCalibration
+def get_grid_cell(H, coords, image):
+    height, width = image.shape[:2]
+    cell_width = width // 8
+    cell_height = height // 8
+    pt = np.array([coords[0], coords[1], 1], dtype="float32")
+    dst_pt = np.dot(H, pt)
+    dst_pt = dst_pt / dst_pt[2]
+    x, y = int(dst_pt[0]), int(dst_pt[1])
+    row, col = y // cell_height, x // cell_width
+    if 0 <= row and row <= 7 and 0 <= col and col <= 7:
+        return row, col
+    return -1, -1
+
+
+def original_squares(calibration, points):
+    image = np.zeros((calibration.size[1], calibration.size[0]))
+    squares = []
+    for point in points:
+        row, col = get_grid_cell(calibration.H, point, image)
+        squares.append(-1 if row == -1 else row * 8 + col)
+    return np.array(squares)
+
+
+def test_whole_pixel_points_match_the_projection():
+    calibration = BoardCalibration.from_corners(CORNERS, (960, 720))
+    points = np.random.default_rng(0).integers(0, 480, size=(2000, 2))
+    assert np.array_equal(calibration.squares(points), original_squares(calibration, points))
+
+
+def test_points_are_looked_up_at_the_nearest_pixel():
+    calibration = BoardCalibration.from_corners(CORNERS, (960, 720))
+    points = np.random.default_rng(1).uniform(0, 479.5, size=(2000, 2))
+    nearest = np.floor(points + .5)
+    assert np.array_equal(calibration.squares(points), original_squares(calibration, nearest))
+
+
+def test_points_outside_the_image_are_off_the_board():
+    calibration = BoardCalibration.from_corners(CORNERS, (960, 720))
+    points = np.array([[-1, 10], [10, -1], [480, 10], [10, 480]])
+    assert list(calibration.squares(points)) == [-1, -1, -1, -1]
+    assert len(calibration.squares(np.zeros((0, 2)))) == 0
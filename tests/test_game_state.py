@@ -0,0 +1,145 @@
+# Drives GameMachine with fakes in place of the camera, engine and brokers. Work submitted
+# to the executor runs inline, so one process() call walks through every finished stage.
+import chess
+import numpy as np
+
+from game_state import BOT_THINKING, GAME_OVER, PLAYER_TURN, GameMachine
+from move_recognition import board_labels, score_moves
+
+
+class InlineExecutor:
+    def submit(self, fn):
+        fn()
+
+
+class DeferredExecutor:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn):
+        self.jobs.append(fn)
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeBot:
+    def __init__(self, clock, search_time=5.0):
+        self.clock = clock
+        self.search_time = search_time
+        self.pondering = False
+
+    def choose_move(self, board, seconds):
+        self.clock.time += self.search_time
+        return next(iter(board.legal_moves))
+
+    def start_pondering(self, board):
+        self.pondering = True
+
+    def stop_pondering(self):
+        self.pondering = False
+
+
+class FakeDelivery:
+    def wait(self, timeout):
+        return True
+
+
+class FakePublisher:
+    def __init__(self):
+        self.published = []
+
+    def __call__(self, board, move, leds):
+        self.published.append((board.fen(), move, leds))
+        return [FakeDelivery()]
+
+
+# What the camera would see for a board, as one-hot class probabilities per square
+def camera_sees(board):
+    probabilities = np.zeros((64, 13))
+    probabilities[np.arange(64), board_labels(board)] = 1.0
+    return probabilities
+
+
+# Recognizes whatever position the fake camera shows, like read_move does
+def make_recognizer(seen):
+    def recognize(board, unmoved_boards, newer_than, cancelled):
+        move, confidence = score_moves(board, camera_sees(seen), unmoved_boards)
+        if move is None:
+            return None
+        board = board.copy()
+        board.push(move)
+        return board
+    return recognize
+
+
+def make_game(seen, bot_color='b', seconds=60):
+    clock = FakeClock()
+    bot = FakeBot(clock)
+    publish = FakePublisher()
+    game = GameMachine(bot, make_recognizer(seen), publish, bot_color, seconds,
+                       executor=InlineExecutor(), now=clock)
+    return game, bot, publish, clock
+
+
+def test_player_move_gets_a_reply():
+    seen = chess.Board()
+    seen.push_san('e4')
+    game, bot, publish, clock = make_game(seen)
+    game.start()
+    assert game.state == PLAYER_TURN
+    assert bot.pondering
+
+    clock.time += 10
+    assert game.confirm_move(clock.time)
+    assert game.process() == PLAYER_TURN
+    assert [move.uci() for move in game.board.move_stack][0] == 'e2e4'
+    assert len(game.board.move_stack) == 2
+    # The player's move without LEDs, then the bot's reply with them
+    assert [leds for fen, move, leds in publish.published] == [False, True]
+    assert game.player_time() == 50
+    assert game.bot_time() == 55
+
+
+def test_bot_first_move_is_charged():
+    game, bot, publish, clock = make_game(chess.Board(), bot_color='w')
+    game.start()
+    assert game.process() == PLAYER_TURN
+    assert len(game.board.move_stack) == 1
+    assert game.bot_time() == 55
+    assert game.player_time() == 60
+
+
+def test_no_move_on_first_turn():
+    game, bot, publish, clock = make_game(chess.Board())
+    game.start()
+    assert game.confirm_move(clock.time)
+    assert game.process() == PLAYER_TURN
+    assert game.board == chess.Board()
+    assert publish.published == []
+
+
+def test_player_flag_falls():
+    game, bot, publish, clock = make_game(chess.Board())
+    game.start()
+    clock.time += 61
+    assert game.process() == GAME_OVER
+    assert game.won is False
+    assert not game.confirm_move(clock.time)
+
+
+def test_restart_drops_late_results():
+    game, bot, publish, clock = make_game(chess.Board(), bot_color='w')
+    game.executor = DeferredExecutor()
+    game.start()
+    assert game.state == BOT_THINKING
+    game.cancel()
+    for job in game.executor.jobs:
+        job()
+    assert game.process() == GAME_OVER
+    assert game.board.move_stack == []
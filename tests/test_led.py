@@ -0,0 +1,79 @@
+import time
+
+from LED import FakePixels, LedCommand, LedDriver, square_to_LED
+from protocol import LED_COLORS, LED_FROM, highlight_frame
+
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+OFF = (0, 0, 0)
+
+
+# Parameters: function returning True once the condition holds
+# Returns: True if it held within a few seconds
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+def test_command_fades_in_holds_and_fades_out():
+    command = LedCommand([RED, BLUE], hold=2, fade=1)
+    start = [OFF, OFF]
+    assert command.colors_at(0, start) == ([OFF, OFF], False)
+    assert command.colors_at(.5, start) == ([(128, 0, 0), (0, 0, 128)], False)
+    assert command.colors_at(1.5, start) == ([RED, BLUE], False)
+    assert command.colors_at(3.5, start) == ([(128, 0, 0), (0, 0, 128)], False)
+    assert command.colors_at(4.5, start) == ([OFF, OFF], True)
+
+
+def test_command_without_hold_keeps_its_colors():
+    command = LedCommand([RED], hold=None, fade=0)
+    assert command.colors_at(1000, [OFF]) == ([RED], False)
+
+
+def test_pulse_dims_only_the_pulse_leds():
+    command = LedCommand([RED, RED], hold=None, fade=0, pulse=[1], pulse_period=1)
+    colors, finished = command.colors_at(.5, [OFF, OFF])
+    assert colors[0] == RED
+    assert colors[1] == (64, 0, 0)
+
+
+def test_newer_command_preempts_and_fades_from_the_shown_colors():
+    pixels = FakePixels(2)
+    driver = LedDriver(pixels)
+    try:
+        driver.send(LedCommand([RED, RED], hold=None, fade=0))
+        assert wait_for(lambda: pixels.shown == [RED, RED])
+        driver.send(LedCommand([BLUE, BLUE], hold=None, fade=10))
+        assert wait_for(lambda: pixels.shown != [RED, RED])
+        # Early in a long fade the strip is still close to red, not starting from black
+        red, green, blue = pixels.shown[0]
+        assert red > 200 and blue < 55
+    finally:
+        driver.stop()
+    assert pixels.shown == [OFF, OFF]
+
+
+def test_only_the_newest_queued_command_is_shown():
+    driver = LedDriver(FakePixels(1))
+    driver.stop()
+    commands = [LedCommand([color], hold=None, fade=0) for color in (RED, (0, 255, 0), BLUE)]
+    for command in commands:
+        driver.commands.put(command)
+    # Commands queued while a frame was drawn are skipped, only the newest is shown
+    assert driver._next_command(0) is commands[-1]
+    assert driver.commands.empty()
+
+
+def test_show_frame_maps_squares_to_leds():
+    pixels = FakePixels(75)
+    driver = LedDriver(pixels)
+    try:
+        driver.show_frame(highlight_frame(0, None), fade=0)
+        assert wait_for(lambda: pixels.shown[square_to_LED(0)] == LED_COLORS[LED_FROM])
+        assert sum(1 for color in pixels.shown if color != OFF) == 1
+    finally:
+        driver.stop()
@@ -0,0 +1,73 @@
+import time
+
+import chess
+import pytest
+
+from protocol import (CHECK, HEADER, BODY, LED_FROM, LED_TO, WHITE_TO_MOVE, BoardMessage, MessageEncoder,
+                      SequenceTracker, decode, encode, highlight_frame)
+
+
+def message(session, seq, timestamp=None):
+    return BoardMessage(session, seq, time.time() if timestamp is None else timestamp, 0, '8/8/8/8/8/8/8/8',
+                        [0] * 64)
+
+
+def test_round_trip():
+    board = chess.Board()
+    board.push_san('e4')
+    board.push_san('f5')
+    board.push_san('Qh5')
+    leds = highlight_frame(chess.D1, chess.H5, chess.E8)
+    payload = encode(513, 7, board.board_fen(), leds, WHITE_TO_MOVE | CHECK, 1234.5)
+    assert len(payload) == HEADER.size + BODY.size == 83
+    decoded = decode(payload)
+    assert decoded == BoardMessage(513, 7, 1234.5, WHITE_TO_MOVE | CHECK, board.board_fen(), leds)
+    assert decoded.leds[chess.D1] == LED_FROM and decoded.leds[chess.H5] == LED_TO
+
+
+def test_encoder_numbers_its_messages():
+    encoder = MessageEncoder(session=3)
+    first, second = (decode(encoder.encode(chess.STARTING_BOARD_FEN)) for i in range(2))
+    assert (first.session, first.seq) == (3, 0)
+    assert (second.session, second.seq) == (3, 1)
+    assert first.fen == chess.STARTING_BOARD_FEN
+
+
+@pytest.mark.parametrize('payload', [b'', b'1 2', encode(1, 1, '8/8/8/8/8/8/8/8')[:-1],
+                                     b'XX' + encode(1, 1, '8/8/8/8/8/8/8/8')[2:],
+                                     b'MG\x02' + encode(1, 1, '8/8/8/8/8/8/8/8')[3:]])
+def test_rejects_other_payloads(payload):
+    with pytest.raises(ValueError):
+        decode(payload)
+
+
+def test_drops_older_messages_of_the_same_session():
+    tracker = SequenceTracker()
+    assert tracker.accept(message(1, 5))
+    assert not tracker.accept(message(1, 5))
+    assert not tracker.accept(message(1, 4))
+    assert tracker.accept(message(1, 6))
+
+
+def test_sequence_wraps_around():
+    tracker = SequenceTracker()
+    assert tracker.accept(message(1, 0xFFFFFFFF))
+    assert tracker.accept(message(1, 0))
+    assert not tracker.accept(message(1, 0xFFFFFFFF))
+
+
+def test_drops_redelivery_from_before_a_restart():
+    tracker = SequenceTracker()
+    now = time.time()
+    assert tracker.accept(message(1, 40, now - 10))
+    # The publisher restarted with a new session
+    assert tracker.accept(message(2, 0, now))
+    # A message of the old session redelivered late
+    assert not tracker.accept(message(1, 41, now - 9))
+    assert tracker.accept(message(2, 1, now + 1))
+
+
+def test_drops_messages_older_than_max_age():
+    tracker = SequenceTracker(max_age=5)
+    assert not tracker.accept(message(1, 0, time.time() - 10))
+    assert tracker.accept(message(1, 1))
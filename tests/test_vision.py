@@ -0,0 +1,50 @@
+import numpy as np
+
+from calibration import BoardCalibration
+from fusion import PIECE_CLASSES
+from vision import assign_squares, piece_dict, piece_threshold
+
+CORNERS = [[130, 270], [553, 61], [448, 667], [923, 343]]
+
+
+# The sequential loop read_frame used before assign_squares, on already looked up squares
+def original_assignment(types, squares, confs):
+    result = [[''] * 8 for row in range(8)]
+    priority = ['k', 'q', 'r', 'p', 'b', 'n', 'K', 'N', 'P', 'R', 'Q', 'B', '']
+    for i in range(len(types) - 1, -1, -1):
+        if squares[i] == -1:
+            continue
+        y, x = divmod(squares[i], 8)
+        if piece_threshold[types[i]] <= confs[i] and (priority.index(types[i]) < priority.index(result[y][x]) or
+                                                      (types[i] == 'b' and result[y][x] == 'k')):
+            result[y][x] = types[i]
+    return result
+
+
+def labels_to_array(labels):
+    return [[PIECE_CLASSES[i] for i in row] for row in labels]
+
+
+def test_matches_the_original_loop_on_random_detections():
+    rng = np.random.default_rng(0)
+    calibration = BoardCalibration.from_corners(CORNERS, (960, 720))
+    for trial in range(2000):
+        n = rng.integers(0, 40)
+        class_ids = rng.integers(0, len(piece_dict), n)
+        confs = rng.uniform(0, 1, n)
+        # Few squares, so kings, bishops and everything else keep landing on the same ones
+        squares = rng.choice([-1, 0, 9, 27, 36, 63], n)
+        expected = original_assignment([piece_dict[i] for i in class_ids], squares, confs)
+        labels = assign_squares(calibration, class_ids, np.zeros((n, 2)), confs, squares)
+        assert labels_to_array(labels) == expected
+
+
+def test_looks_up_squares_from_points():
+    calibration = BoardCalibration.from_corners(CORNERS, (960, 720))
+    # Board coordinates of the square centers, mapped back into the image
+    centers = np.array([[(col + .5) * 60, (row + .5) * 60] for row in range(8) for col in range(8)], dtype=np.float64)
+    points = (np.c_[centers, np.ones(64)] @ calibration.H_inv.T)
+    points = points[:, :2] / points[:, 2:]
+    kings = np.full(64, 1)
+    labels = assign_squares(calibration, kings, points, np.ones(64))
+    assert labels_to_array(labels) == [['k'] * 8 for row in range(8)]
@@ -0,0 +1,152 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import collections
+import time
+
+import numpy as np
+import pygame
+
+import metrics
+
+# Fonts and rendered text surfaces, so each string is rendered once instead of every frame
+class TextCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.fonts = {}
+        self.surfaces = collections.OrderedDict()
+
+    # Parameters: Instance of TextCache, font size int
+    # Returns: pygame Font
+
+    def font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.SysFont(None, size)
+        return self.fonts[size]
+
+    # Parameters: Instance of TextCache, text string, font size int, RGB tuple
+    # Returns: pygame Surface
+
+    def render(self, text, size, color):
+        key = (text, size, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.font(size).render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_entries:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+# Keeps track of what each named region of the screen shows. A region is only repainted
+# when its key (whatever its content depends on) or its rect changes, and only the
+# repainted rects are sent to the display. Regions must not overlap.
+class DirtyScreen:
+    def __init__(self, screen, background=(30, 30, 30)):
+        self.screen = screen
+        self.background = background
+        self.mode = None
+        self.regions = {}
+        self.dirty = []
+        self.drew = False
+
+    # Parameters: Instance of DirtyScreen, name of the current screen (e.g. 'timer')
+    # Returns: None
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.mode = mode
+            self.clear()
+
+    # Parameters: Instance of DirtyScreen
+    # Returns: None
+
+    def clear(self):
+        self.screen.fill(self.background)
+        self.regions = {}
+        self.dirty = [self.screen.get_rect()]
+
+    # Parameters: Instance of DirtyScreen, region name, key of its content, pygame Rect, function painting the region
+    # Returns: None
+
+    def draw(self, name, key, rect, paint):
+        rect = pygame.Rect(rect)
+        previous = self.regions.get(name)
+        if previous == (key, rect):
+            return
+        if previous is not None:
+            self.screen.fill(self.background, previous[1])
+            self.dirty.append(previous[1])
+        self.screen.fill(self.background, rect)
+        paint(self.screen)
+        self.dirty.append(rect)
+        self.regions[name] = (key, rect)
+
+    # Parameters: Instance of DirtyScreen, region name
+    # Returns: None
+
+    def remove(self, name):
+        previous = self.regions.pop(name, None)
+        if previous is not None:
+            self.screen.fill(self.background, previous[1])
+            self.dirty.append(previous[1])
+
+    # Parameters: Instance of DirtyScreen
+    # Returns: True if anything was sent to the display
+
+    def flip(self):
+        self.drew = bool(self.dirty)
+        if self.dirty:
+            pygame.display.update(self.dirty)
+            self.dirty = []
+        return self.drew
+
+# Time spent per frame of a display loop, not counting the time it sleeps in clock.tick()
+class FrameTimer:
+    def __init__(self, window=250):
+        self.times = collections.deque(maxlen=window)
+        self.frames = 0
+        self.drawn = 0
+        self.started = None
+
+    # Parameters: Instance of FrameTimer
+    # Returns: None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    # Parameters: Instance of FrameTimer, whether the frame was drawn boolean
+    # Returns: None
+
+    def stop(self, drew=True):
+        if self.started is None:
+            return
+        duration = time.perf_counter() - self.started
+        self.times.append(duration)
+        metrics.observe('ui.frame', duration)
+        self.started = None
+        self.frames += 1
+        self.drawn += bool(drew)
+
+    # Parameters: Instance of FrameTimer
+    # Returns: one line summary string
+
+    def summary(self):
+        if not self.times:
+            return "no frames"
+        times = np.array(self.times) * 1000
+        return "frame time {:.2f} ms mean, {:.2f} ms p95, {} of {} frames drawn".format(
+            np.mean(times), np.percentile(times, 95), self.drawn, self.frames)
+
+    # Parameters: Instance of FrameTimer
+    # Returns: None
+
+    def reset(self):
+        self.times.clear()
+        self.frames = 0
+        self.drawn = 0
+        self.started = None
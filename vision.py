@@ -0,0 +1,450 @@
+# ------------------------------------------------------------------------------------
+# Author: Mason Boucher
+# Project: Cyber-Physical Systems Engineering Jumpstart - Magic Gambit
+# Teammates: Alex Angeloff, Michael Habib, Nima Sichani
+# Special Thanks: Dr. Nestor Tiglao, Dr. Romel Gomez, Anuj Zore, Amna Hayat, Reta Gela
+# ------------------------------------------------------------------------------------
+import logging
+
+import cv2
+import numpy as np
+import pygame
+import metrics
+from renderer import BoardRenderer
+from fusion import BoardFusion, PIECE_CLASSES
+from detector import load_backend
+from move_recognition import score_moves
+
+IMAGE_X, IMAGE_Y = 480,480
+
+# Threshold values for piece detection
+piece_threshold = {
+    'k': .01, #.01
+    'p': .3, #.3
+    'n': .1, #.1
+    'b': .5, #.5
+    'r': .4, #.4
+    'q': .3, #.3
+    'K': .2, #.2
+    'P': .2, #.2
+    'N': .4, #.4
+    'B': .1, #.1
+    'R': .05, #.05
+    'Q': .01, #.01
+}
+
+# Piece detector backend, loaded by load_model() or on first use
+model = None
+
+# Parameters: path to .pt weights, .onnx file or OpenVINO model directory
+# Returns: detector backend
+
+def load_model(weights='best.pt'):
+    global model
+    model = load_backend(weights, IMAGE_X)
+    return model
+
+# Parameters: None
+# Returns: detector backend
+
+def get_model():
+    if model is None:
+        load_model()
+    return model
+
+# Model class ids to piece names
+piece_dict = {
+    0: 'b',
+    1: 'k',
+    2: 'n',
+    3: 'p',
+    4: 'q',
+    5: 'r',
+    6: 'B',
+    7: 'K',
+    8: 'N',
+    9: 'P',
+    10: 'Q',
+    11: 'R'
+}
+
+# Parameter: Nx4 array of xyxy boxes, array of class ids, array of confidences
+# Returns: array of class ids, Nx2 array of piece base points, array of confidences
+
+def boxes_to_arrays(xyxy, class_ids, confidences):
+  points = np.column_stack(((xyxy[:, 0] + xyxy[:, 2])/2, (xyxy[:, 1] + 4*xyxy[:, 3])/5))
+  return class_ids, points, confidences
+
+# Parameter: list of 2D arrays of frames of the same size, inference size int (model default if None)
+# Returns: list of (array of class ids, Nx2 array of piece base points, array of confidences) per frame
+
+def detect_pieces_arrays_batch(imgs, imgsz=None):
+  metrics.count('inference.frames', len(imgs))
+  with metrics.timer('inference'):
+    boxes = get_model().predict(imgs, 0.01, imgsz)
+  return [boxes_to_arrays(*frame_boxes) for frame_boxes in boxes]
+
+# Parameter: 2D array of frame, inference size int (model default if None)
+# Returns: array of class ids, Nx2 array of piece base points, array of confidences
+
+def detect_pieces_arrays(img, imgsz=None):
+  return detect_pieces_arrays_batch([img], imgsz)[0]
+
+# Parameter: inference size int (model default if None)
+# Returns: None
+
+def warm_up_model(imgsz=None):
+  # The first inference sets up the runtime, run it on a blank frame before the first move
+  size = imgsz or IMAGE_X
+  detect_pieces_arrays_batch([np.zeros((size, size, 3), dtype=np.uint8)], imgsz)
+
+# Parameter: array of class ids, Nx2 array of points, array of confidences, print boolean
+# Returns: list of piece names, list of coordinate pairs, list of confidences
+
+def arrays_to_lists(class_ids, points, confidences, show=False):
+  coords = []
+  pieces = []
+  confs = []
+  for point, label, confidence in zip(points, class_ids, confidences):
+      coords.append((point[0], point[1]))
+      pieces.append(piece_dict[label])
+      confs.append(confidence)
+      if show:
+          metrics.log(logging.DEBUG, 'detection', x=float(point[0]), y=float(point[1]), piece=piece_dict[label], confidence=float(confidence))
+  return pieces, coords, confs
+
+# Parameter: 2D array of frame
+# Returns: list of piece names, list of coordinate pairs, list of confidences
+
+def detect_pieces(img):
+  return arrays_to_lists(*detect_pieces_arrays(img), show=True)
+
+# Parameter: list of 2D arrays of frames of the same size
+# Returns: list of (list of piece names, list of coordinate pairs, list of confidences) per frame
+
+def detect_pieces_batch(imgs):
+  return [arrays_to_lists(*arrays) for arrays in detect_pieces_arrays_batch(imgs)]
+
+# Parameters: image path, transformation matrix
+# Returns: None
+
+def display_grid(image, H):
+    height, width = image.shape[:2]
+    top_down_view = cv2.warpPerspective(image, H, (width, height))
+
+    cell_width = width // 8
+    cell_height = height // 8
+    for i in range(9):
+        cv2.line(top_down_view, (0, i * cell_height), (width, i * cell_height), (0, 0, 255), 2)
+        cv2.line(top_down_view, (i * cell_width, 0), (i * cell_width, height), (0, 0, 255), 2)
+
+    H_inv = np.linalg.inv(H)
+    angled_view_with_grid = cv2.warpPerspective(top_down_view, H_inv, (image.shape[1], image.shape[0]))
+
+    cv2.imshow('grid', angled_view_with_grid)
+    cv2.waitKey(0)
+
+# Parameters: 3x3 perspective transformation array, coordinate pair, image path
+# Returns: row and column of proper square (indexed from top left)
+
+def get_grid_cell(H, coords, image):
+    height, width = image.shape[:2]
+    cell_width = width // 8
+    cell_height = height // 8
+
+    pt = np.array([coords[0], coords[1], 1], dtype="float32")
+    
+    dst_pt = np.dot(H, pt)
+    dst_pt = dst_pt / dst_pt[2]
+    
+    x, y = int(dst_pt[0]), int(dst_pt[1])
+    row, col = y // cell_height, x // cell_width
+  
+    if 0 <= row and row <= 7 and 0 <= col and col <= 7:
+        return row, col
+    return -1,-1
+
+# Parameters: None
+# Returns: priority rank array and threshold array, both indexed by model class id
+
+def class_tables():
+    ranks = np.array([PIECE_CLASSES.index(piece_dict[i]) for i in range(len(piece_dict))])
+    thresholds = np.array([piece_threshold[piece_dict[i]] for i in range(len(piece_dict))], dtype=np.float64)
+    return ranks, thresholds
+
+# Parameters: Instance of BoardCalibration, array of class ids, Nx2 array of points, array of confidences,
+#             array of the points' squares if already looked up
+# Returns: 8x8 array of indices into PIECE_CLASSES
+
+def assign_squares(calibration, class_ids, points, confs, squares=None):
+    board = np.full(64, len(PIECE_CLASSES) - 1)
+    n = len(class_ids)
+    if n == 0:
+        return board.reshape(8, 8)
+
+    # Every point is mapped to its square with one lookup table read
+    if squares is None:
+        squares = calibration.squares(points)
+    squares = np.asarray(squares).astype(int)
+    ranks, thresholds = class_tables()
+    class_ids = np.asarray(class_ids)
+    valid = (squares != -1) & (np.asarray(confs) >= thresholds[class_ids])
+    square = squares[valid]
+    rank = ranks[class_ids][valid]
+    # Detections are visited from last to first, order is the step each one is visited at
+    order = (n - 1 - np.arange(n))[valid]
+
+    # The highest priority piece wins a square, except that a bishop replaces a king. On squares
+    # with a king, the last king stands unless a bishop follows it, and then only the detections
+    # from that bishop onwards compete.
+    king, bishop = PIECE_CLASSES.index('k'), PIECE_CLASSES.index('b')
+    last_king = np.full(64, -1)
+    np.maximum.at(last_king, square[rank == king], order[rank == king])
+    late_bishop = (rank == bishop) & (order > last_king[square])
+    first_bishop = np.full(64, n)
+    np.minimum.at(first_bishop, square[late_bishop], order[late_bishop])
+    cutoff = np.where(last_king >= 0, first_bishop, -1)
+    keep = order >= cutoff[square]
+    np.minimum.at(board, square[keep], rank[keep])
+    board[(last_king >= 0) & (first_bishop == n)] = king
+    return board.reshape(8, 8)
+
+# Parameters: Instance of BoardCalibration, array of class ids, Nx2 array of points, array of confidences
+# Returns: 64xN array of class probabilities per square, columns in PIECE_CLASSES order
+
+def square_probabilities(calibration, class_ids, points, confs):
+    scores = np.zeros((64, len(PIECE_CLASSES)))
+    if len(class_ids) != 0:
+        squares = calibration.squares(points).astype(int)
+        ranks, thresholds = class_tables()
+        valid = squares != -1
+        # Best confidence of each class on each square, without the per-class thresholds
+        np.maximum.at(scores, (squares[valid], ranks[np.asarray(class_ids)][valid]), np.asarray(confs)[valid])
+    scores[:, -1] = 1 - np.max(scores[:, :-1], axis=1)
+    scores += 1e-3
+    return scores / np.sum(scores, axis=1, keepdims=True)
+
+# Parameter: FEN string
+# Returns: 2D list of position
+
+def FEN_to_array(fen):
+    result = [[]]
+    for char in fen:
+        if char.isdigit():
+            for i in range(int(char)):
+                result[-1].append('')
+        elif char == '/':
+            result.append([])
+        else:
+            result[-1].append(char)
+    return result
+
+# Parameter: 2D list of position
+# Returns: FEN string
+
+def array_to_FEN(array):
+    fen = ""
+    for i in array:
+        empty_spaces = 0
+        for j in i:
+            if j == "":
+                empty_spaces += 1
+            elif empty_spaces != 0:
+                fen += str(empty_spaces)
+                fen += j
+                empty_spaces = 0
+            else:
+                fen += j
+        fen += str(empty_spaces) if empty_spaces > 0 else ''
+        fen += "/"
+    fen = fen[:len(fen)-1]
+    return fen
+
+# Parameter: 2D list of position
+# Returns: printable and formatted string of position
+
+def array_to_string(array):
+    result = ''
+    for row in array:
+        for char in row:
+            if char == '':
+                result += '-'
+            result += char
+            result += ' '
+        result += '\n'
+    return result
+
+# Parameter: 2D list of position
+# Returns: None
+
+def display_board(piece_list):
+    screen = pygame.display.set_mode((480, 480))
+    pygame.display.set_caption("Chess Board")
+    BoardRenderer(screen, 60).update(piece_list)
+
+    # Nothing changes until the window is closed, sleep until then
+    while pygame.event.wait().type != pygame.QUIT:
+        pass
+
+    pygame.quit()
+
+# Parameters: Instance of BoardCalibration, (width, height) of frame, margin in squares, extra top margin in squares
+# Returns: (x0, y0, x1, y1) box around the board in frame coordinates
+
+def board_roi(calibration, frame_size, margin=.25, top_margin=1):
+    corners = calibration.frame_corners(frame_size)
+    x0, y0 = np.min(corners, axis=0)
+    x1, y1 = np.max(corners, axis=0)
+    # Tall pieces on the far rows reach above the board outline
+    square = max(x1 - x0, y1 - y0) / 8
+    x0 = int(max(0, x0 - margin * square))
+    y0 = int(max(0, y0 - (margin + top_margin) * square))
+    x1 = int(min(frame_size[0], x1 + margin * square))
+    y1 = int(min(frame_size[1], y1 + margin * square))
+    return x0, y0, x1, y1
+
+# Parameters: 2D array of frame, Instance of BoardCalibration, inference size int
+# Returns: 2D array of cropped board region, (x and y scale array, x0, y0) of the crop
+
+def crop_board(img, calibration, roi_size=320):
+    x0, y0, x1, y1 = board_roi(calibration, (img.shape[1], img.shape[0]))
+    crop = img[y0:y1, x0:x1]
+    # Stretch x and y like the full frame resize to IMAGE_X x IMAGE_Y does, so pieces have the
+    # shape the detector sees in full frames, then fit the longer side to roi_size
+    scale = np.array([IMAGE_X / img.shape[1], IMAGE_Y / img.shape[0]])
+    scale *= roi_size / max(crop.shape[1] * scale[0], crop.shape[0] * scale[1])
+    crop = cv2.resize(crop, (round(crop.shape[1] * scale[0]), round(crop.shape[0] * scale[1])))
+    return crop, (scale, x0, y0)
+
+# Parameters: Nx2 array of points in the crop, (x and y scale array, x0, y0) of the crop, Instance of BoardCalibration, (width, height) of frame
+# Returns: Nx2 array of points in calibration coordinates
+
+def crop_to_board(points, crop, calibration, frame_size):
+    scale, x0, y0 = crop
+    return (points / scale + np.array([x0, y0])) * np.array([calibration.size[0] / frame_size[0], calibration.size[1] / frame_size[1]])
+
+# Parameters: 2D array of frame, Instance of BoardCalibration, inference size int
+# Returns: array of class ids, Nx2 array of points in calibration coordinates, array of confidences
+
+def detect_pieces_roi(img, calibration, roi_size=320):
+    crop_img, crop = crop_board(img, calibration, roi_size)
+    class_ids, points, confs = detect_pieces_arrays(crop_img, roi_size)
+    return class_ids, crop_to_board(points, crop, calibration, (img.shape[1], img.shape[0])), confs
+
+# Parameters: list of 2D arrays of frames, Instance of BoardCalibration, board region inference size int (whole frame if None)
+# Returns: list of detections in calibration coordinates per frame, list of resized frames (None in board
+#          region mode, the crops are all that gets inferred)
+
+def detect_board(imgs, calibration, roi_size=None):
+    if roi_size is None:
+        resized = [cv2.resize(img,(IMAGE_X,IMAGE_Y)) for img in imgs]
+        detections = detect_pieces_arrays_batch(resized)
+    else:
+        resized = [None] * len(imgs)
+        crops = [crop_board(img, calibration, roi_size) for img in imgs]
+        detections = detect_pieces_arrays_batch([crop_img for crop_img, crop in crops], roi_size)
+        detections = [(class_ids, crop_to_board(points, crop, calibration, (img.shape[1], img.shape[0])), confs)
+                      for (class_ids, points, confs), (crop_img, crop), img in zip(detections, crops, imgs)]
+    return detections, resized
+
+# Parameters: list of 2D arrays of frames, Instance of BoardCalibration, board region inference size int (whole frame if None)
+# Returns: list of (2D list of position, resized frame or None) per frame, from one batched inference
+
+def read_arrays(imgs, calibration, roi_size=None):
+    detections, resized = detect_board(imgs, calibration, roi_size)
+    results = []
+    for (class_ids, points, confs), img in zip(detections, resized):
+        with metrics.timer('assignment'):
+            labels = assign_squares(calibration, class_ids, points, confs)
+        results.append(([[PIECE_CLASSES[i] for i in row] for row in labels], img))
+    return results
+
+# Parameters: 2D array of frame, Instance of BoardCalibration, board region inference size int (whole frame if None)
+# Returns: 2D list of position, resized frame or None
+
+def read_array(img, calibration, roi_size=None):
+    return read_arrays([img], calibration, roi_size)[0]
+
+# Parameters: 2D array of frame, Instance of BoardCalibration, print boolean, grid boolean, display boolean,
+#             board region inference size int
+# Returns: FEN string
+
+def read_frame(frame, calibration, show_string=False, show_grid=False, show_pos=False, roi_size=None):
+    result, img = read_array(frame, calibration, roi_size)
+
+    if show_string:
+        metrics.log(logging.INFO, 'board\n' + array_to_string(result))
+    if show_grid:
+        if img is None:
+            img = cv2.resize(frame,(IMAGE_X,IMAGE_Y))
+        display_grid(img, calibration.H)
+    if show_pos:
+        display_board(result)
+        
+    return array_to_FEN(result)
+
+# Parameters: Initialized camera frame source, Instance of BoardCalibration, monotonic time float,
+#             frames per fusion window int, required confidence float, frame limit int, print boolean,
+#             board region inference size int
+# Returns: FEN string or None if no confident position was found
+
+def read_frame_fused(cam, calibration, newer_than=None, window=5, confidence=.6, max_frames=15, show_string=False, roi_size=None):
+    fusion = BoardFusion(window, confidence)
+    last_frame = newer_than
+    frames_read = 0
+    # Two clean frames that agree are enough, after that frames are inferred in batches
+    batch_size = fusion.min_frames
+    while frames_read < max_frames:
+        imgs = []
+        while len(imgs) < min(batch_size, max_frames - frames_read):
+            timestamp, img = cam.read(last_frame)
+            if img is None:
+                break
+            last_frame = timestamp
+            imgs.append(img)
+        if not imgs:
+            break
+        if frames_read > 0:
+            metrics.count('recognition.retries')
+        frames_read += len(imgs)
+        metrics.count('recognition.frames', len(imgs))
+        for result, img in read_arrays(imgs, calibration, roi_size):
+            fusion.add(result)
+            if fusion.is_confident():
+                result, agreement = fusion.estimate()
+                if show_string:
+                    metrics.log(logging.INFO, 'board\n' + array_to_string(result), agreement=round(agreement, 2))
+                return array_to_FEN(result)
+        batch_size = max(1, window - fusion.min_frames)
+    metrics.count('recognition.failed')
+    return None
+
+# Parameters: Initialized camera frame source, Instance of BoardCalibration, Instance of Board class before the
+#             player's move, monotonic time float, frames per window int, required confidence float,
+#             board region inference size int, list of Board instances that mean no move was made yet
+# Returns: Instance of Move class (None if no move was made), confidence float
+
+def read_move(cam, calibration, board, newer_than=None, window=5, confidence=.9, roi_size=None, unmoved_boards=()):
+    probabilities = []
+    last_frame = newer_than
+    move, move_confidence = None, 0.0
+    # A clean first frame is enough on its own, otherwise average over a batch of frames
+    for batch_size in (1, max(1, window - 1)):
+        imgs = []
+        while len(imgs) < batch_size:
+            timestamp, img = cam.read(last_frame)
+            if img is None:
+                break
+            last_frame = timestamp
+            imgs.append(img)
+        if not imgs:
+            break
+        if probabilities:
+            metrics.count('recognition.retries')
+        metrics.count('recognition.frames', len(imgs))
+        detections, resized = detect_board(imgs, calibration, roi_size)
+        probabilities += [square_probabilities(calibration, *d) for d in detections]
+        move, move_confidence = score_moves(board, np.mean(probabilities, axis=0), unmoved_boards)
+        if move_confidence >= confidence:
+            break
+    return move, move_confidence